@@ -1,18 +1,36 @@
 from __future__ import annotations
 
+import io
 import os
+import csv
+import codecs
+import sys
 import json
+import time
 import asyncio
-from collections import deque
-from typing import Optional, NoReturn
-
+import pstats
+import cProfile
+import tempfile
+import threading
+import traceback
+import tracemalloc
+import weakref
+from collections import Counter, deque, OrderedDict
+from contextlib import asynccontextmanager
+from itertools import islice
+from dataclasses import dataclass, field, fields, asdict
+from typing import Optional, NoReturn, NamedTuple
+
+import aiohttp
 import discord
 from discord.ext import commands
 import wavelink
 from discord import app_commands
 
+from storage import Store, open_store
+
 # --- Web/Render keep-alive (Render Web Service oczekuje nasłuchiwania na porcie) ---
-from flask import Flask
+from flask import Flask, Response
 
 app = Flask(__name__)
 
@@ -27,6 +45,11 @@ def health():
     return {"ok": True}
 
 
+@app.get("/metrics")
+def metrics():
+    return Response(_render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
 async def _run_web_server():
     """Uruchamia prosty serwer HTTP w tle (dla Render Web Service)."""
     port = int(os.environ.get("PORT", "10000"))
@@ -38,6 +61,74 @@ async def _run_web_server():
     loop = asyncio.get_running_loop()
     await loop.run_in_executor(None, _run)
 
+# ==========================
+# METRICS (format Prometheus, endpoint /metrics)
+# ==========================
+# (nazwa, posortowane etykiety) -> wartość licznika
+_counters: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+
+
+def _inc(name: str, value: float = 1, **labels: str):
+    key = (name, tuple(sorted(labels.items())))
+    _counters[key] = _counters.get(key, 0) + value
+
+
+# nazwa -> (granice kubełków, liczniki kubełków, suma, liczba obserwacji)
+_histograms: dict[str, tuple[tuple[float, ...], list[int], list[float]]] = {}
+
+
+def _observe(name: str, value: float, buckets: tuple[float, ...]):
+    h = _histograms.get(name)
+    if h is None:
+        h = _histograms[name] = (buckets, [0] * (len(buckets) + 1), [0.0, 0.0])
+    bounds, counts, totals = h
+    for i, b in enumerate(bounds):
+        if value <= b:
+            counts[i] += 1
+            break
+    else:
+        counts[-1] += 1
+    totals[0] += value
+    totals[1] += 1
+
+
+# Czas od odebrania interakcji (slash) do pierwszego potwierdzenia: defer albo pierwsza odpowiedź.
+_ACK_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 5.0)
+
+
+class _MeteredTree(app_commands.CommandTree):
+    """Zapisuje moment odebrania komendy slash w `interaction.extras` (patrz `_note_ack`)."""
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.type == discord.InteractionType.application_command:
+            interaction.extras.setdefault("received_at", time.monotonic())
+        return True
+
+
+def _note_ack(interaction: Optional[discord.Interaction]):
+    """Wywoływane po pierwszym potwierdzeniu interakcji; kolejne wywołania nic nie robią."""
+    received = interaction.extras.pop("received_at", None) if interaction is not None else None
+    if received is not None:
+        _observe("interaction_ack_seconds", time.monotonic() - received, _ACK_BUCKETS)
+
+
+def _render_metrics() -> str:
+    lines = []
+    for (name, labels), value in sorted(list(_counters.items())):
+        label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+        lines.append(f"{name}{{{label_str}}} {value:g}" if label_str else f"{name} {value:g}")
+    for name, (bounds, counts, totals) in sorted(list(_histograms.items())):
+        cumulative = 0
+        for b, c in zip(bounds, counts):
+            cumulative += c
+            lines.append(f'{name}_bucket{{le="{b:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {cumulative + counts[-1]}')
+        lines.append(f"{name}_sum {totals[0]:g}")
+        lines.append(f"{name}_count {totals[1]:g}")
+    for k, v in list(_search_stats.items()):
+        lines.append(f"search_{k}_total {v}")
+    return "\n".join(lines) + "\n"
+
 # ==========================
 # CONFIG
 # ==========================
@@ -48,13 +139,26 @@ if not TOKEN:
 # Auto-disconnect, gdy nic nie gra i kolejka pusta
 IDLE_DISCONNECT_SECONDS = int(os.environ.get("IDLE_DISCONNECT_SECONDS", "300"))  # 5 min
 
-# Domyślne ustawienia (komendami można je ustawić w trakcie działania bota)
+# Domyślne ustawienia nowego serwera (komendami można je zmienić; zapisywane w magazynie stanu)
 VC_CHANNEL_ID = 0       # Kanał głosowy, na którym bot ma działać
 TEXT_CHANNEL_ID = 0     # Kanał tekstowy, w którym komendy są akceptowane
 ALLOWED_ROLE_NAME = "Nekromanta"  # Rola, która może używać komend
 
+# Stary plik playlist – importowany jednorazowo do magazynu stanu.
 PLAYLISTS_FILE = "playlists.json"
 
+# Magazyn współdzielony przez procesy shardów: file://, sqlite:/// albo redis:// (patrz storage.py)
+STATE_STORE = os.environ.get("STATE_STORE", "file://state.json")
+
+# Cache wyszukiwań (zapytanie -> utwór) w magazynie stanu; 0 wyłącza.
+SEARCH_CACHE_TTL_SECONDS = int(os.environ.get("SEARCH_CACHE_TTL_SECONDS", "21600"))  # 6 h
+
+# Sharding: SHARD_COUNT (łączna liczba shardów) + SHARD_IDS (shardy tego procesu, np. "0,1").
+# Ustawia je zwykle supervisor.py; AUTO_SHARD=1 bez SHARD_COUNT = liczba shardów z Discorda.
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "0"))
+SHARD_IDS = [int(x) for x in os.environ.get("SHARD_IDS", "").split(",") if x.strip()]
+AUTO_SHARD = os.environ.get("AUTO_SHARD", "0") == "1"
+
 # Slash commands: dla jednego serwera najlepiej użyć guild sync (pojawia się od razu).
 # Możesz nadpisać to zmienną środowiskową GUILD_ID na Render.
 GUILD_ID = int(os.environ.get("GUILD_ID", "1470577436335931584"))
@@ -68,37 +172,139 @@ if os.environ.get("ENABLE_MESSAGE_CONTENT_INTENT", "1") == "1":
     intents.message_content = True
 
 # Wyłączamy wbudowaną komendę `help`, bo mamy własną.
-bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)
+if SHARD_COUNT or AUTO_SHARD:
+    bot = commands.AutoShardedBot(
+        command_prefix="!",
+        intents=intents,
+        help_command=None,
+        shard_count=SHARD_COUNT or None,
+        shard_ids=SHARD_IDS or None,
+        tree_cls=_MeteredTree,
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents, help_command=None, tree_cls=_MeteredTree)
 
 # Tree dla slash commands
 _tree = bot.tree
 
+store: Store = open_store(STATE_STORE)
+
 # ==========================
 # STATE
 # ==========================
-queue: deque[wavelink.Playable] = deque()
-current_track: Optional[wavelink.Playable] = None
-playlists: dict[str, list[str]] = {}
+LOOP_OFF = "off"
+LOOP_SONG = "song"
+LOOP_QUEUE = "queue"
+
+TRANSITION_IDLE = "idle"
+TRANSITION_PLAYING = "playing"
+TRANSITION_ADVANCING = "advancing"
+
+# Ile ostatnio odtworzonych utworów pamiętać na serwer (`!history`, `!back`).
+HISTORY_SIZE = int(os.environ.get("HISTORY_SIZE", "50"))
+# Po tylu odtworzeniach utwór ma odświeżany wpis w cache wyszukiwań przy każdym kolejnym graniu.
+WARM_PLAY_COUNT = int(os.environ.get("WARM_PLAY_COUNT", "3"))
+
+
+@dataclass
+class GuildSession:
+    """Stan odtwarzania jednego serwera (tylko w pamięci procesu, który go obsługuje)."""
+
+    guild_id: int
+    queue: deque[wavelink.Playable] = field(default_factory=deque)
+    current_track: Optional[wavelink.Playable] = None
+    loop_mode: str = LOOP_OFF
+    idle_task: Optional[asyncio.Task] = None
+    # Komendy i zdarzenia zmieniające sesję wykonują się po kolei (asyncio.Lock jest FIFO).
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Wersja kolejki – podbijana przy każdej zmianie; na niej opiera się cache podglądu kolejki.
+    queue_version: int = 0
+    # (queue_version, tekst pola "Następne", linie pierwszych QUEUE_PREVIEW_SIZE pozycji – też 1. strona `!queue`)
+    preview_cache: tuple[int, str, tuple[str, ...]] = (-1, "", ())
+    # Ostatnio odtworzone utwory (raw_data z Lavalinka) – do `!back` bez ponownego wyszukiwania.
+    history: deque[dict] = field(default_factory=lambda: deque(maxlen=HISTORY_SIZE))
+    # Maszyna stanów przejść: każde player.play() to nowa generacja; dla jednej generacji
+    # może się odbyć co najwyżej jedno przejście dalej (end/exception/stuck/skip w dowolnej kolejności).
+    transition: str = TRANSITION_IDLE
+    generation: int = 0
+    advanced_generation: int = 0
+    # `encoded` utworu, po którego wyjątku Lavalink dośle jeszcze TrackEnd(loadFailed) – do zignorowania.
+    pending_stale_end: Optional[str] = None
+    # (queue_version, bajty) – szacunek pamięci kolejki i historii, liczony ponownie po zmianie kolejki.
+    memory_cache: tuple[int, int] = (-1, 0)
+    # Żywa wiadomość "Teraz gra" (`!now_live`): zdarzenia ustawiają `np_dirty`, jedno zadanie robi edycje.
+    np_message: Optional[discord.Message | discord.PartialMessage] = None
+    np_dirty: asyncio.Event = field(default_factory=asyncio.Event)
+    np_task: Optional[asyncio.Task] = None
+
+    def queue_changed(self):
+        self.queue_version += 1
+        self.np_dirty.set()
+
+
+@dataclass
+class GuildConfig:
+    """Ustawienia serwera z `!set_vc` / `!set_text` / `!set_role` (trzymane w magazynie stanu)."""
+
+    vc_channel_id: int = VC_CHANNEL_ID
+    text_channel_id: int = TEXT_CHANNEL_ID
+    allowed_role_id: int = 0
+    # Starsze zapisy (i rola domyślna) mają tylko nazwę – przy pierwszym sprawdzeniu zamieniana na ID.
+    allowed_role_name: str = ALLOWED_ROLE_NAME
+    # Kanał żywej wiadomości "Teraz gra" (0 = wyłączona) i sama wiadomość – po restarcie edytujemy tę samą.
+    now_playing_channel_id: int = 0
+    now_playing_message_id: int = 0
+
+
+_sessions: dict[int, GuildSession] = {}
+_guild_configs: dict[int, GuildConfig] = {}
+# guild id -> ID ról uprawnionych (None = bez ograniczeń); czyszczone przy zmianach ról i konfiguracji.
+_allowed_roles: dict[int, Optional[frozenset[int]]] = {}
+
+
+def _session(guild: discord.Guild) -> GuildSession:
+    s = _sessions.get(guild.id)
+    if s is None:
+        s = _sessions[guild.id] = GuildSession(guild.id)
+    return s
+
+
+async def _guild_config(guild_id: int) -> GuildConfig:
+    """Konfiguracja serwera; z magazynu wczytywana raz, potem z pamięci (serwer należy do jednego sharda)."""
+    cfg = _guild_configs.get(guild_id)
+    if cfg is not None:
+        return cfg
+
+    try:
+        data = await store.get(f"guild:{guild_id}") or {}
+    except Exception as e:
+        print(f"Nie udało się wczytać konfiguracji serwera {guild_id}: {e}")
+        data = {}
+    known = {f.name for f in fields(GuildConfig)}
+    # Przy równoległym pierwszym odczycie wygrywa jeden obiekt – zmiany z komend nie giną.
+    return _guild_configs.setdefault(guild_id, GuildConfig(**{k: v for k, v in data.items() if k in known}))
 
-_idle_task: Optional[asyncio.Task] = None
 
+async def _save_guild_config(guild_id: int):
+    cfg = await _guild_config(guild_id)
+    _allowed_roles.pop(guild_id, None)
+    await store.set(f"guild:{guild_id}", asdict(cfg))
 
-def _cancel_idle_task():
-    global _idle_task
-    if _idle_task and not _idle_task.done():
-        _idle_task.cancel()
-    _idle_task = None
+
+def _cancel_idle_task(session: GuildSession):
+    if session.idle_task and not session.idle_task.done():
+        session.idle_task.cancel()
+    session.idle_task = None
 
 
 def _schedule_idle_disconnect(guild: discord.Guild):
     """Uruchamia timer rozłączenia, jeśli przez dłuższy czas nic nie gra i kolejka jest pusta."""
-    global _idle_task
-
     # Nie planuj, jeśli mechanizm jest wyłączony
     if IDLE_DISCONNECT_SECONDS <= 0:
         return
 
-    _cancel_idle_task()
+    session = _session(guild)
+    _cancel_idle_task(session)
 
     async def _job():
         try:
@@ -108,34 +314,73 @@ def _schedule_idle_disconnect(guild: discord.Guild):
                 return
 
             # Rozłącz tylko jeśli nadal nic nie gra i brak kolejki
-            if (not queue) and (not player.playing) and (not player.paused):
+            if (not session.queue) and (not player.playing) and (not player.paused):
                 await player.disconnect()
+                session.np_dirty.set()
                 print(f"Idle timeout: rozłączono z VC po {IDLE_DISCONNECT_SECONDS}s bezczynności")
         except asyncio.CancelledError:
             return
         except Exception as e:
             print(f"Błąd idle disconnect: {e}")
 
-    _idle_task = bot.loop.create_task(_job())
+    session.idle_task = bot.loop.create_task(_job())
 
 # ==========================
 # PLAYLIST STORAGE
 # ==========================
-def load_playlists():
-    global playlists
+# Playlisty są wspólne dla wszystkich serwerów: zbiór nazw + osobna lista wpisów na playlistę.
+_PLAYLIST_INDEX_KEY = "playlists"
+
+
+def _playlist_key(name: str) -> str:
+    return f"playlist:{name}"
+
+
+async def _playlist_owner(name: str, claim_for: Optional[int] = None) -> Optional[int]:
+    """Serwer, któremu liczy się miejsce zajmowane przez playlistę (QUOTA_STORAGE_BYTES).
+
+    Właścicielem jest serwer, który ją utworzył; playlista sprzed limitów przypada serwerowi `claim_for`.
+    """
+    key = f"playlist_owner:{name}"
+    owner = await store.get(key)
+    if owner is None and claim_for is not None:
+        owner = claim_for
+        await store.set(key, owner)
+    return int(owner) if owner is not None else None
+
+
+async def playlist_names() -> list[str]:
+    return sorted(await store.smembers(_PLAYLIST_INDEX_KEY))
+
+
+async def playlist_exists(name: str) -> bool:
+    return name in await store.smembers(_PLAYLIST_INDEX_KEY)
+
+
+def _read_json(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+async def load_playlists():
+    """Jednorazowy import starego playlists.json, jeśli magazyn nie ma jeszcze playlist."""
     try:
-        with open(PLAYLISTS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            playlists = data if isinstance(data, dict) else {}
+        if await store.smembers(_PLAYLIST_INDEX_KEY):
+            return
+        data = await asyncio.to_thread(_read_json, PLAYLISTS_FILE)
     except FileNotFoundError:
-        playlists = {}
-    except Exception:
-        playlists = {}
-
+        return
+    except Exception as e:
+        print(f"Nie udało się zaimportować {PLAYLISTS_FILE}: {e}")
+        return
 
-def save_playlists():
-    with open(PLAYLISTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(playlists, f, indent=4, ensure_ascii=False)
+    if not isinstance(data, dict):
+        return
+    for name, items in data.items():
+        await store.sadd(_PLAYLIST_INDEX_KEY, name)
+        if items:
+            await store.rpush(_playlist_key(name), *items)
+    print(f"Zaimportowano {len(data)} playlist z {PLAYLISTS_FILE}")
 
 # ==========================
 # HELPERS
@@ -144,20 +389,351 @@ def _real_users(channel: discord.VoiceChannel):
     return [m for m in channel.members if not m.bot]
 
 
-def role_only():
+async def _allowed_role_ids(guild: discord.Guild) -> Optional[frozenset[int]]:
+    """ID ról uprawnionych na serwerze (None = bez ograniczeń), liczone raz i trzymane w `_allowed_roles`."""
+    if guild.id in _allowed_roles:
+        return _allowed_roles[guild.id]
+
+    cfg = await _guild_config(guild.id)
+    if cfg.allowed_role_id:
+        ids: Optional[frozenset[int]] = frozenset((cfg.allowed_role_id,))
+    elif cfg.allowed_role_name:
+        ids = frozenset(r.id for r in guild.roles if r.name == cfg.allowed_role_name)
+        if len(ids) == 1:
+            # Jednoznaczna nazwa -> zapisujemy ID, dalej zmiana nazwy roli niczego nie psuje.
+            cfg.allowed_role_id = next(iter(ids))
+            try:
+                await _save_guild_config(guild.id)
+            except Exception as e:
+                print(f"Nie udało się zapisać ID roli dla serwera {guild.id}: {e}")
+    else:
+        ids = None
+    _allowed_roles[guild.id] = ids
+    return ids
+
+
+async def _has_access(guild: Optional[discord.Guild], channel, member) -> bool:
+    if guild is None:
+        return False
+    cfg = await _guild_config(guild.id)
+    # Jeżeli nie ustawiono kanału tekstowego, pozwól użyć komendy wszędzie.
+    if cfg.text_channel_id and getattr(channel, "id", None) != cfg.text_channel_id:
+        return False
+    # Jeżeli nie ustawiono roli, pozwól wszystkim (ułatwia pierwszą konfigurację).
+    allowed = await _allowed_role_ids(guild)
+    if allowed is None:
+        return True
+    get_role = getattr(member, "get_role", None)
+    return get_role is not None and any(get_role(role_id) is not None for role_id in allowed)
+
+
+def role_only(admins: bool = False):
+    """`admins=True`: administrator serwera przechodzi zawsze (np. `!set_role`, żeby dało się naprawić konfigurację)."""
+
     async def predicate(ctx: commands.Context):
-        # Jeżeli nie ustawiono kanału tekstowego, pozwól użyć komendy wszędzie.
-        if TEXT_CHANNEL_ID and ctx.channel.id != TEXT_CHANNEL_ID:
-            return False
-        # Jeżeli nie ustawiono roli, pozwól wszystkim (ułatwia pierwszą konfigurację).
-        if not ALLOWED_ROLE_NAME:
-            return True
-        role = discord.utils.get(ctx.author.roles, name=ALLOWED_ROLE_NAME)
-        return role is not None
+        if admins:
+            perms = getattr(ctx.author, "guild_permissions", None)
+            if perms and perms.administrator:
+                return True
+        return await _has_access(ctx.guild, ctx.channel, ctx.author)
+
+    return commands.check(predicate)
+
+
+# ==========================
+# ADMISSION (token bucket per użytkownik i per serwer)
+# ==========================
+# Tokeny na sekundę / pojemność kubełka. Nadmiar czekający krócej niż MAX_WAIT jest kolejkowany, reszta odrzucana
+# – zanim ruszy jakiekolwiek wyszukiwanie.
+ADMISSION_USER_RATE = float(os.environ.get("ADMISSION_USER_RATE", "0.5"))
+ADMISSION_USER_BURST = float(os.environ.get("ADMISSION_USER_BURST", "5"))
+ADMISSION_GUILD_RATE = float(os.environ.get("ADMISSION_GUILD_RATE", "3"))
+ADMISSION_GUILD_BURST = float(os.environ.get("ADMISSION_GUILD_BURST", "20"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", "2"))
+ADMISSION_PLAYLIST_COST = float(os.environ.get("ADMISSION_PLAYLIST_COST", "5"))
+_ADMISSION_MAX_BUCKETS = 10_000
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Ile sekund trzeba poczekać na `cost` tokenów (0 = od razu)."""
+        self._refill(now)
+        if self.tokens >= cost:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost: float):
+        # Może zejść poniżej zera – to rezerwacja dla zakolejkowanego żądania.
+        self.tokens -= cost
+
+
+class AdmissionRejected(commands.CheckFailure):
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"admission rejected ({scope})")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+_user_buckets: OrderedDict[int, TokenBucket] = OrderedDict()
+_guild_buckets: OrderedDict[int, TokenBucket] = OrderedDict()
+
+
+def _bucket(buckets: OrderedDict[int, TokenBucket], key: int, rate: float, capacity: float) -> TokenBucket:
+    b = buckets.get(key)
+    if b is None:
+        b = buckets[key] = TokenBucket(rate, capacity)
+        if len(buckets) > _ADMISSION_MAX_BUCKETS:
+            buckets.popitem(last=False)
+    else:
+        buckets.move_to_end(key)
+    return b
+
+
+async def _admit(guild_id: int, user_id: int, cost: float):
+    """Przepuszcza, kolejkuje (krótki sleep) albo rzuca AdmissionRejected; decyzje -> `admission_decisions_total`."""
+    now = time.monotonic()
+    user = _bucket(_user_buckets, user_id, ADMISSION_USER_RATE, ADMISSION_USER_BURST)
+    guild = _bucket(_guild_buckets, guild_id, ADMISSION_GUILD_RATE, ADMISSION_GUILD_BURST)
+    user_wait = user.wait_time(cost, now)
+    guild_wait = guild.wait_time(cost, now)
+    wait = max(user_wait, guild_wait)
+
+    if wait > ADMISSION_MAX_WAIT_SECONDS:
+        scope = "user" if user_wait >= guild_wait else "guild"
+        _inc("admission_decisions_total", decision="rejected", scope=scope)
+        raise AdmissionRejected(scope, wait)
+
+    user.take(cost)
+    guild.take(cost)
+    if wait > 0:
+        _inc("admission_decisions_total", decision="queued", scope="user" if user_wait >= guild_wait else "guild")
+        await asyncio.sleep(wait)
+    else:
+        _inc("admission_decisions_total", decision="admitted", scope="all")
+
+
+def admission(cost: float = 1.0):
+    """Check ograniczający tempo komend (patrz `_admit`)."""
+
+    async def predicate(ctx: commands.Context):
+        if ctx.guild is not None:
+            # Kolejkowanie może trwać do ADMISSION_MAX_WAIT_SECONDS – slash potwierdzamy od razu.
+            await _defer(ctx)
+            await _admit(ctx.guild.id, ctx.author.id, cost)
+        return True
 
     return commands.check(predicate)
 
 
+def _admission_message(error: AdmissionRejected) -> discord.Embed:
+    who = "Ty wysyłasz" if error.scope == "user" else "Serwer wysyła"
+    return _music_embed("Zwolnij", f"{who} za dużo komend. Spróbuj za **{error.retry_after:.1f}s**.")
+
+
+# ==========================
+# QUOTAS (zużycie zasobów per serwer)
+# ==========================
+# Jeden serwer z ogromną kolejką/playlistą nie może zagłodzić pozostałych w tym procesie. 0 = bez limitu.
+QUOTA_QUEUE_ITEMS = int(os.environ.get("QUOTA_QUEUE_ITEMS", "1000"))
+QUOTA_MEMORY_BYTES = int(os.environ.get("QUOTA_MEMORY_BYTES", str(8 * 1024 * 1024)))
+QUOTA_SEARCHES = int(os.environ.get("QUOTA_SEARCHES", "4"))
+QUOTA_STORAGE_BYTES = int(os.environ.get("QUOTA_STORAGE_BYTES", str(5 * 1024 * 1024)))
+
+# Obiekt Playable + słownik raw_data poza samymi napisami (szacunek).
+_TRACK_OVERHEAD_BYTES = 1024
+
+_QUOTA_LABELS = {
+    "queue": "liczba utworów w kolejce",
+    "memory": "pamięć kolejki",
+    "searches": "równoległe wyszukiwania",
+    "storage": "miejsce na playlisty",
+}
+
+# guild id -> wyszukiwania w toku (komendy + podpowiedzi)
+_searches_in_flight: Counter = Counter()
+# guild id -> bajty wpisów playlist, których właścicielem jest serwer – lokalna kopia licznika `usage:<id>`
+# z magazynu (zmieniany atomowo, bo kilka procesów może liczyć ten sam serwer)
+_storage_usage: dict[int, int] = {}
+
+
+class QuotaExceeded(commands.CommandError):
+    def __init__(self, resource: str, used: int, limit: int):
+        super().__init__(f"quota {resource}: {used}/{limit}")
+        self.resource = resource
+        self.used = used
+        self.limit = limit
+
+
+class GuildUsage(NamedTuple):
+    queue_items: int
+    memory_bytes: int
+    searches: int
+    storage_bytes: int
+
+
+def _format_bytes(n: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def _quota_message(error: QuotaExceeded) -> discord.Embed:
+    used, limit = error.used, error.limit
+    if error.resource in ("memory", "storage"):
+        used, limit = _format_bytes(used), _format_bytes(limit)
+    hint = {
+        "queue": "Poczekaj, aż kolejka się skróci, albo wyczyść ją `!stop`.",
+        "memory": "Poczekaj, aż kolejka się skróci, albo wyczyść ją `!stop`.",
+        "searches": "Poczekaj, aż skończą się trwające wyszukiwania.",
+        "storage": "Usuń niepotrzebne wpisy z playlist (`!playlist_remove`).",
+    }[error.resource]
+    return _music_embed("Limit serwera", f"Osiągnięto limit: **{_QUOTA_LABELS[error.resource]}** ({used}/{limit}).\n{hint}")
+
+
+def _entry_bytes(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+def _track_bytes(track: wavelink.Playable) -> int:
+    n = _TRACK_OVERHEAD_BYTES + len(getattr(track, "encoded", None) or "")
+    for attr in ("title", "author", "uri", "identifier"):
+        n += len(getattr(track, attr, None) or "")
+    return n
+
+
+def _raw_bytes(raw: dict) -> int:
+    info = raw.get("info") or {}
+    n = _TRACK_OVERHEAD_BYTES + len(raw.get("encoded") or "")
+    for key in ("title", "author", "uri", "identifier"):
+        n += len(info.get(key) or "")
+    return n
+
+
+def _session_memory(session: GuildSession) -> int:
+    """Szacowana pamięć kolejki, bieżącego utworu i historii; przeliczana tylko po zmianie kolejki."""
+    version, cached = session.memory_cache
+    if version == session.queue_version:
+        return cached
+    total = sum(_track_bytes(t) for t in session.queue)
+    if session.current_track is not None:
+        total += _track_bytes(session.current_track)
+    total += sum(_raw_bytes(raw) for raw in session.history)
+    _, text, lines = session.preview_cache
+    total += len(text) + sum(len(line) for line in lines)
+    session.memory_cache = (session.queue_version, total)
+    return total
+
+
+def _guild_usage(guild_id: int) -> GuildUsage:
+    session = _sessions.get(guild_id)
+    return GuildUsage(
+        queue_items=len(session.queue) if session else 0,
+        memory_bytes=_session_memory(session) if session else 0,
+        searches=_searches_in_flight[guild_id],
+        storage_bytes=_storage_usage.get(guild_id, 0),
+    )
+
+
+def _queue_room(session: GuildSession) -> Optional[int]:
+    """Ile utworów zmieści się jeszcze w kolejce wg limitu liczby (None = bez limitu)."""
+    return max(0, QUOTA_QUEUE_ITEMS - len(session.queue)) if QUOTA_QUEUE_ITEMS else None
+
+
+def _check_queue_quota(session: GuildSession, tracks: list[wavelink.Playable] = ()) -> int:
+    """Ile początkowych `tracks` zmieści się w kolejce; QuotaExceeded, gdy kolejka jest pełna albo nie wejdzie żaden."""
+    room = _queue_room(session)
+    if room == 0:
+        raise QuotaExceeded("queue", len(session.queue), QUOTA_QUEUE_ITEMS)
+    fits = len(tracks) if room is None else min(len(tracks), room)
+    if QUOTA_MEMORY_BYTES:
+        used = _session_memory(session)
+        budget = QUOTA_MEMORY_BYTES - used
+        for i, track in enumerate(tracks[:fits]):
+            budget -= _track_bytes(track)
+            if budget < 0:
+                fits = i
+                break
+        if budget <= 0 and fits == 0:
+            raise QuotaExceeded("memory", used, QUOTA_MEMORY_BYTES)
+    return fits
+
+
+@asynccontextmanager
+async def _search_slot(guild_id: int):
+    """Zajmuje miejsce na wyszukiwanie serwera albo rzuca QuotaExceeded."""
+    if QUOTA_SEARCHES and _searches_in_flight[guild_id] >= QUOTA_SEARCHES:
+        raise QuotaExceeded("searches", _searches_in_flight[guild_id], QUOTA_SEARCHES)
+    _searches_in_flight[guild_id] += 1
+    try:
+        yield
+    finally:
+        _searches_in_flight[guild_id] -= 1
+        if _searches_in_flight[guild_id] <= 0:
+            del _searches_in_flight[guild_id]
+
+
+async def _load_storage_usage(guild_id: int, *, fresh: bool = False) -> int:
+    """Zużycie miejsca serwera; `fresh=True` czyta z magazynu (właściciel playlisty bywa na innym shardzie)."""
+    if fresh or guild_id not in _storage_usage:
+        try:
+            used = int(await store.get(f"usage:{guild_id}") or 0)
+        except Exception as e:
+            print(f"Nie udało się wczytać zużycia miejsca serwera {guild_id}: {e}")
+            if guild_id in _storage_usage:
+                return _storage_usage[guild_id]
+            used = 0
+        _storage_usage[guild_id] = max(0, used)
+    return _storage_usage[guild_id]
+
+
+async def _push_entries(guild_id: int, key: str, entries: list[str]) -> int:
+    """Dopisuje do playlisty tyle początkowych wpisów, ile mieści limit miejsca jej właściciela
+    (`guild_id` z `_playlist_owner`); zwraca ich liczbę."""
+    used = await _load_storage_usage(guild_id, fresh=True)
+    sizes = [_entry_bytes(e) for e in entries]
+    fits = len(entries)
+    if QUOTA_STORAGE_BYTES:
+        budget = QUOTA_STORAGE_BYTES - used
+        for i, n in enumerate(sizes):
+            budget -= n
+            if budget < 0:
+                fits = i
+                break
+    if fits:
+        await store.rpush(key, *entries[:fits])
+        await _charge_storage(guild_id, sum(sizes[:fits]))
+    return fits
+
+
+async def _charge_storage(guild_id: int, delta: int):
+    """Zapisuje zmianę zużycia miejsca właściciela playlisty (dodanie i usunięcie liczą się temu samemu serwerowi).
+
+    Atomowy przyrost w magazynie – kilka procesów może naraz liczyć ten sam serwer.
+    """
+    try:
+        used = await store.incrby(f"usage:{guild_id}", delta)
+    except Exception as e:
+        print(f"Nie udało się zapisać zużycia miejsca serwera {guild_id}: {e}")
+        used = await _load_storage_usage(guild_id) + delta
+    _storage_usage[guild_id] = max(0, used)
+
+
 async def _get_player(guild: discord.Guild) -> Optional[wavelink.Player]:
     vc = guild.voice_client
     return vc if isinstance(vc, wavelink.Player) else None
@@ -172,12 +748,13 @@ async def join_vc(channel: discord.VoiceChannel) -> wavelink.Player:
         raise
 
 
-async def ensure_connected(ctx: commands.Context) -> Optional[wavelink.Player]:
-    if not VC_CHANNEL_ID:
+async def ensure_connected(ctx: commands.Context | discord.Interaction) -> Optional[wavelink.Player]:
+    cfg = await _guild_config(ctx.guild.id)
+    if not cfg.vc_channel_id:
         await _safe_send(ctx, embed=_music_embed("Konfiguracja", "**Nie ustawiono kanału VC.**\nUżyj: `!set_vc <kanał>`"))
         return None
 
-    vc_channel = ctx.guild.get_channel(VC_CHANNEL_ID)
+    vc_channel = ctx.guild.get_channel(cfg.vc_channel_id)
     if not isinstance(vc_channel, discord.VoiceChannel):
         await _safe_send(
             ctx,
@@ -198,36 +775,42 @@ async def ensure_connected(ctx: commands.Context) -> Optional[wavelink.Player]:
 async def leave_vc_if_empty(channel: discord.VoiceChannel):
     humans = _real_users(channel)
     if len(humans) == 0:
-        try:
-            player = await _get_player(channel.guild)
-            if player:
-                await player.disconnect()
-        except Exception as e:
-            print(f"Błąd disconnect: {e}")
-        queue.clear()
-        global current_track
-        current_track = None
+        session = _session(channel.guild)
+        async with session.lock:
+            try:
+                player = await _get_player(channel.guild)
+                if player:
+                    await player.disconnect()
+            except Exception as e:
+                print(f"Błąd disconnect: {e}")
+            session.queue.clear()
+            session.queue_changed()
+            session.current_track = None
+            session.transition = TRANSITION_IDLE
         print("VC pusty, bot rozłączony; kolejka wyczyszczona")
 
 
-async def enqueue_and_maybe_play(ctx: commands.Context, player: wavelink.Player, track: wavelink.Playable):
-    queue.append(track)
+async def enqueue_and_maybe_play(ctx: commands.Context | discord.Interaction, player: wavelink.Player, track: wavelink.Playable):
+    """Wywołujący musi trzymać `session.lock`. `ctx` może być też Interaction (komendy slash)."""
+    session = _session(ctx.guild)
+    _check_queue_quota(session, [track])
+    session.queue.append(track)
+    session.queue_changed()
 
-    e = _music_embed("Dodano do kolejki", _track_line(track))
-    e.add_field(name="Pozycja w kolejce", value=str(len(queue)), inline=True)
+    r = _render_track(track)
+    e = _music_embed("Dodano do kolejki", r.line)
+    e.add_field(name="Pozycja w kolejce", value=str(len(session.queue)), inline=True)
 
-    dur = _track_duration_ms(track)
-    if dur:
-        e.add_field(name="Długość", value=_format_duration_ms(dur), inline=True)
+    if r.duration:
+        e.add_field(name="Długość", value=r.duration, inline=True)
 
-    thumb = _guess_youtube_thumbnail(_track_url(track))
-    if thumb:
-        e.set_thumbnail(url=thumb)
+    if r.thumbnail:
+        e.set_thumbnail(url=r.thumbnail)
 
-    await ctx.send(embed=e)
+    await _safe_send(ctx, embed=e)
 
     # Mamy aktywność -> anuluj idle timer
-    _cancel_idle_task()
+    _cancel_idle_task(session)
 
     # Jeśli nic nie gra, startuj od razu.
     if not player.playing and not player.paused:
@@ -235,57 +818,234 @@ async def enqueue_and_maybe_play(ctx: commands.Context, player: wavelink.Player,
 
 
 async def play_next(guild: discord.Guild):
+    """Przejście do następnego utworu. Wywołujący musi trzymać `session.lock`."""
     player = await _get_player(guild)
     if not player:
         return
 
-    global current_track
+    session = _session(guild)
+
+    # Utwór, który właśnie się skończył, trafia do historii.
+    if session.current_track is not None:
+        _remember_played(session, session.current_track)
 
     try:
         # Loop pojedynczego utworu: odtwarzaj w kółko to samo
-        if loop_mode == LOOP_SONG and current_track is not None:
-            _cancel_idle_task()
-            await player.play(current_track)
+        if session.loop_mode == LOOP_SONG and session.current_track is not None:
+            _cancel_idle_task(session)
+            await _start_track(session, player, session.current_track)
             return
 
         # Loop kolejki: po zakończeniu utworu wrzuć go na koniec
-        if loop_mode == LOOP_QUEUE and current_track is not None:
-            queue.append(current_track)
-
-        if not queue:
-            current_track = None
+        if session.loop_mode == LOOP_QUEUE and session.current_track is not None:
+            session.queue.append(session.current_track)
+            session.queue_changed()
+
+        if not session.queue:
+            session.current_track = None
+            session.transition = TRANSITION_IDLE
+            session.np_dirty.set()
             _schedule_idle_disconnect(guild)
             return
 
-        _cancel_idle_task()
+        _cancel_idle_task(session)
 
-        next_track = queue.popleft()
-        current_track = next_track
-        await player.play(next_track)
+        next_track = session.queue.popleft()
+        session.queue_changed()
+        session.current_track = next_track
+        await _start_track(session, player, next_track)
     except Exception as e:
+        session.transition = TRANSITION_IDLE
         print(f"Błąd play_next/play: {e}")
         # jeśli coś poszło nie tak, spróbuj przejść dalej (bez pętli)
         try:
-            if queue:
-                current_track = None
+            if session.queue:
+                session.current_track = None
                 await play_next(guild)
         except Exception:
             pass
 
 
-async def _search_track(query: str) -> Optional[wavelink.Playable]:
-    q = query.strip()
-    if not q:
-        return None
+async def _start_track(session: GuildSession, player: wavelink.Player, track: wavelink.Playable):
+    session.generation += 1
+    session.transition = TRANSITION_ADVANCING
+    await player.play(track)
+    session.transition = TRANSITION_PLAYING
+    session.np_dirty.set()
+    await _ensure_now_playing(player.guild)
 
-    # Wavelink v2+ – uniwersalne wyszukiwanie.
+
+async def _advance_after(payload, kind: str):
+    """Jedno przejście dalej na zakończony utwór, niezależnie od kolejności i liczby zdarzeń.
+
+    kind: "end" | "exception" | "stuck". Zdarzenia nieaktualne albo zdublowane są liczone
+    w `track_transitions_suppressed_total`.
+    """
+    player = payload.player
+    if player is None or player.guild is None:
+        return
+    session = _session(player.guild)
+    encoded = getattr(payload.track, "encoded", None)
+    reason = str(getattr(payload, "reason", "")).lower()
+
+    async with session.lock:
+        current = session.current_track
+        suppressed = None
+
+        if kind == "end" and reason in ("replaced", "cleanup"):
+            # replaced: sami puściliśmy już następny utwór; cleanup: player zniszczony
+            suppressed = reason
+        elif kind == "end" and encoded and session.pending_stale_end == encoded:
+            session.pending_stale_end = None
+            suppressed = "after_exception"
+        elif current is None or session.transition == TRANSITION_IDLE:
+            suppressed = "idle"
+        elif encoded and getattr(current, "encoded", None) != encoded:
+            suppressed = "stale_track"
+        elif session.advanced_generation == session.generation:
+            suppressed = "duplicate"
+
+        if suppressed:
+            _inc("track_transitions_suppressed_total", reason=suppressed, event=kind)
+            return
+
+        session.advanced_generation = session.generation
+        if kind == "exception":
+            session.pending_stale_end = encoded
+        _inc("track_transitions_total", event=kind)
+        await play_next(player.guild)
+
+
+def _remember_played(session: GuildSession, track: wavelink.Playable):
+    raw = getattr(track, "raw_data", None)
+    if not raw:
+        return
+
+    identifier = getattr(track, "identifier", None)
+    last = session.history[-1] if session.history else None
+    if not (last and identifier and last.get("info", {}).get("identifier") == identifier):
+        session.history.append(raw)
+
+    if not identifier:
+        return
+    _play_counts[identifier] = count = _play_counts.get(identifier, 0) + 1
+    _play_counts.move_to_end(identifier)
+    if len(_play_counts) > _PLAY_COUNTS_SIZE:
+        _play_counts.popitem(last=False)
+    if count >= WARM_PLAY_COUNT and SEARCH_CACHE_TTL_SECONDS > 0:
+        cache_key = _track_queries.get(identifier)
+        if cache_key:
+            bot.loop.create_task(_keep_warm(cache_key, raw))
+
+
+async def _keep_warm(cache_key: str, raw: dict):
+    """Odświeża TTL wpisu cache dla często granego utworu."""
     try:
-        results = await wavelink.Playable.search(q)
+        await store.set(cache_key, raw, ttl=SEARCH_CACHE_TTL_SECONDS)
     except Exception as e:
-        # To jest najczęstsze miejsce problemów (brak node, błąd Lavalink, brak source).
-        print(f"Błąd Playable.search dla '{q}': {type(e).__name__}: {e}")
-        return None
+        print(f"Nie udało się odświeżyć cache wyszukiwania: {e}")
+
+
+# Wyszukiwanie ma twardy deadline, żeby jeden wolny Lavalink nie zawiesił `!play`/`!playlist_play`.
+SEARCH_TIMEOUT_SECONDS = float(os.environ.get("SEARCH_TIMEOUT_SECONDS", "10"))
+# Hedging: przy >1 nodzie, jeśli pierwszy nie odpowie w czasie percentyla, pytamy drugi.
+SEARCH_HEDGE_PERCENTILE = float(os.environ.get("SEARCH_HEDGE_PERCENTILE", "0.95"))
+SEARCH_HEDGE_MIN_SECONDS = float(os.environ.get("SEARCH_HEDGE_MIN_SECONDS", "0.25"))
+SEARCH_HEDGE_DEFAULT_SECONDS = float(os.environ.get("SEARCH_HEDGE_DEFAULT_SECONDS", "1.5"))
+_SEARCH_HEDGE_MIN_SAMPLES = 20
+
+# Czasy pojedynczych (udanych) odpowiedzi node'ów – z nich liczymy próg hedgingu.
+_search_latencies: deque[float] = deque(maxlen=256)
+_search_stats: dict[str, int] = {"searches": 0, "timeouts": 0, "hedged": 0, "hedge_wins": 0}
+
+# identifier utworu -> klucz cache wyszukiwania, z którego pochodzi (do utrzymywania "ciepłych" wpisów)
+_track_queries: OrderedDict[str, str] = OrderedDict()
+_TRACK_QUERIES_SIZE = 4096
+# identifier utworu -> liczba odtworzeń (w tym procesie)
+# (LRU – dawno niegrane utwory wypadają, licznik zaczyna się wtedy od nowa)
+_play_counts: OrderedDict[str, int] = OrderedDict()
+_PLAY_COUNTS_SIZE = 4096
+
+
+def _hedge_delay() -> float:
+    """Po ilu sekundach wysłać zapasowe zapytanie (percentyl ostatnich czasów odpowiedzi)."""
+    if len(_search_latencies) < _SEARCH_HEDGE_MIN_SAMPLES:
+        return SEARCH_HEDGE_DEFAULT_SECONDS
+    samples = sorted(_search_latencies)
+    idx = min(len(samples) - 1, int(len(samples) * SEARCH_HEDGE_PERCENTILE))
+    return max(SEARCH_HEDGE_MIN_SECONDS, samples[idx])
+
+
+def _search_nodes() -> list:
+    """Połączone nody, od najmniej obciążonego (liczba playerów)."""
+    Pool = getattr(wavelink, "Pool", None)
+    nodes = getattr(Pool, "nodes", None) if Pool is not None else None
+    if not isinstance(nodes, dict):
+        return []
+    connected = [n for n in nodes.values() if getattr(n, "status", None) == wavelink.NodeStatus.CONNECTED]
+    return sorted(connected, key=lambda n: len(getattr(n, "players", {}) or {}))
+
+
+async def _timed_search(q: str, node=None):
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    if node is None:
+        results = await wavelink.Playable.search(q)
+    else:
+        results = await wavelink.Playable.search(q, node=node)
+    _search_latencies.append(loop.time() - started)
+    return results
+
+
+async def _hedged_search(q: str):
+    """Wyszukiwanie z deadlinem; przy >1 nodzie z opóźnionym zapytaniem zapasowym.
+
+    Rzuca asyncio.TimeoutError po SEARCH_TIMEOUT_SECONDS.
+    """
+    _search_stats["searches"] += 1
+    nodes = _search_nodes()
+    if len(nodes) < 2:
+        return await asyncio.wait_for(_timed_search(q), timeout=SEARCH_TIMEOUT_SECONDS)
 
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SEARCH_TIMEOUT_SECONDS
+
+    primary = asyncio.create_task(_timed_search(q, nodes[0]))
+    pending = {primary}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=min(_hedge_delay(), SEARCH_TIMEOUT_SECONDS))
+        # Brak odpowiedzi w czasie percentyla albo szybki błąd -> pytamy drugi node.
+        if not done or primary.exception() is not None:
+            _search_stats["hedged"] += 1
+            pending = {t for t in pending if not t.done()}
+            pending.add(asyncio.create_task(_timed_search(q, nodes[1])))
+        else:
+            return primary.result()
+
+        last_error: Optional[BaseException] = primary.exception() if primary.done() else None
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    if t is not primary:
+                        _search_stats["hedge_wins"] += 1
+                    return t.result()
+                last_error = t.exception()
+            if not done:
+                break
+
+        if pending or last_error is None:
+            raise asyncio.TimeoutError()
+        raise last_error
+    finally:
+        for t in pending:
+            t.cancel()
+
+
+def _first_track(results) -> Optional[wavelink.Playable]:
     if not results:
         return None
 
@@ -299,9 +1059,78 @@ async def _search_track(query: str) -> Optional[wavelink.Playable]:
 
     return results
 
+
+async def _search_track(query: str) -> Optional[wavelink.Playable]:
+    q = query.strip()
+    if not q:
+        return None
+
+    # Cache wyszukiwań jest w magazynie stanu, więc jest wspólny dla wszystkich shardów.
+    cache_key = f"search:{q.lower()}"
+    if SEARCH_CACHE_TTL_SECONDS > 0:
+        try:
+            raw = await store.get(cache_key)
+            if raw:
+                track = wavelink.Playable(raw)
+                _remember_query(track, cache_key)
+                return track
+        except Exception as e:
+            print(f"Błąd cache wyszukiwania dla '{q}': {type(e).__name__}: {e}")
+
+    # Wavelink v2+ – uniwersalne wyszukiwanie.
+    try:
+        results = await _hedged_search(q)
+    except asyncio.TimeoutError:
+        _search_stats["timeouts"] += 1
+        print(f"Timeout Playable.search dla '{q}' (>{SEARCH_TIMEOUT_SECONDS}s)")
+        return None
+    except Exception as e:
+        # To jest najczęstsze miejsce problemów (brak node, błąd Lavalink, brak source).
+        print(f"Błąd Playable.search dla '{q}': {type(e).__name__}: {e}")
+        return None
+
+    track = _first_track(results)
+    raw_data = getattr(track, "raw_data", None)
+    if raw_data and SEARCH_CACHE_TTL_SECONDS > 0:
+        _remember_query(track, cache_key)
+        try:
+            await store.set(cache_key, raw_data, ttl=SEARCH_CACHE_TTL_SECONDS)
+        except Exception as e:
+            print(f"Nie udało się zapisać cache wyszukiwania: {e}")
+    return track
+
+
+def _remember_query(track: wavelink.Playable, cache_key: str):
+    identifier = getattr(track, "identifier", None)
+    if not identifier:
+        return
+    _track_queries[identifier] = cache_key
+    _track_queries.move_to_end(identifier)
+    if len(_track_queries) > _TRACK_QUERIES_SIZE:
+        _track_queries.popitem(last=False)
+
 # ==========================
 # WAVELINK NODE
 # ==========================
+# Ile sekund Lavalink trzyma sesję (playery, kolejkę zdarzeń) po zerwaniu websocketu; 0 wyłącza wznawianie.
+LAVALINK_RESUME_TIMEOUT = int(os.environ.get("LAVALINK_RESUME_TIMEOUT", "120"))
+
+# identifier node'a -> monotonic() zerwania połączenia (do pomiaru czasu wznowienia)
+_node_dropped_at: dict[str, float] = {}
+_nodes_seen: set[str] = set()
+
+
+def _parse_extra_nodes(raw: str) -> list[str]:
+    """`host1:2333,host2` -> ["host1:2333", "host2:2333"]"""
+    out = []
+    for part in raw.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        out.append(part if ":" in part else f"{part}:2333")
+    return out
+
+
 async def _connect_lavalink():
     """Łączy się z Lavalink w sposób kompatybilny z różnymi wersjami Wavelink."""
     host = os.environ.get("LAVALINK_HOST")
@@ -324,8 +1153,16 @@ async def _connect_lavalink():
             if isinstance(nodes, list) and nodes:
                 return
 
-            node = wavelink.Node(uri=f"{'https' if use_https else 'http'}://{host}:{port}", password=password)
-            await Pool.connect(client=bot, nodes=[node])
+            scheme = "https" if use_https else "http"
+            nodes = [
+                wavelink.Node(uri=f"{scheme}://{host}:{port}", password=password, resume_timeout=LAVALINK_RESUME_TIMEOUT)
+            ]
+            # Dodatkowe nody (host:port, po przecinku, to samo hasło) – używane m.in. do hedgingu wyszukiwania.
+            for extra in _parse_extra_nodes(os.environ.get("LAVALINK_EXTRA_NODES", "")):
+                nodes.append(
+                    wavelink.Node(uri=f"{scheme}://{extra}", password=password, resume_timeout=LAVALINK_RESUME_TIMEOUT)
+                )
+            await Pool.connect(client=bot, nodes=nodes)
             return
     except Exception as e:
         print(f"Nie udało się połączyć z Lavalink przez Pool.connect: {e}")
@@ -362,7 +1199,7 @@ async def on_ready():
 
     await _connect_lavalink()
 
-    load_playlists()
+    await load_playlists()
 
     # Sync robimy w setup_hook() (żeby /komendy pojawiały się poprawnie)
 
@@ -373,26 +1210,87 @@ async def on_ready():
 # ==========================
 @bot.event
 async def on_voice_state_update(member, before, after):
-    if VC_CHANNEL_ID == 0:
+    cfg = await _guild_config(member.guild.id)
+    if cfg.vc_channel_id == 0:
         return
 
     # Gdy ktoś wejdzie na kanał głosowy
-    if after.channel and after.channel.id == VC_CHANNEL_ID and not member.bot:
+    if after.channel and after.channel.id == cfg.vc_channel_id and not member.bot:
         vc_channel = after.channel
         player = await _get_player(vc_channel.guild)
         if not player:
             await join_vc(vc_channel)
+        else:
+            # Ktoś znów słucha – wznów żywą wiadomość "Teraz gra" (jeśli włączona).
+            await _ensure_now_playing(vc_channel.guild)
 
     # Gdy ktoś wychodzi z kanału
-    if before.channel and before.channel.id == VC_CHANNEL_ID:
+    if before.channel and before.channel.id == cfg.vc_channel_id:
         await leave_vc_if_empty(before.channel)
 
 
+@bot.event
+async def on_guild_role_create(role: discord.Role):
+    # Rola o "starej" nazwie z konfiguracji mogła właśnie powstać.
+    _allowed_roles.pop(role.guild.id, None)
+
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    _allowed_roles.pop(after.guild.id, None)
+
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    _allowed_roles.pop(role.guild.id, None)
+    cfg = await _guild_config(role.guild.id)
+    if role.id != cfg.allowed_role_id:
+        return
+    # Tej roli nikt już nie dostanie – bez czyszczenia serwer byłby zablokowany na zawsze
+    # (`!set_role` też wymaga roli). Jak przy braku roli: dostęp dla wszystkich do nowego `!set_role`.
+    cfg.allowed_role_id = 0
+    cfg.allowed_role_name = ""
+    print(f"Usunięto skonfigurowaną rolę {role.id} na serwerze {role.guild.id}; konfiguracja wyczyszczona")
+    try:
+        await _save_guild_config(role.guild.id)
+    except Exception as e:
+        print(f"Nie udało się zapisać konfiguracji serwera {role.guild.id}: {e}")
+
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    # Konfiguracja zostaje w magazynie; po ponownym dodaniu bota wczyta się od nowa.
+    _guild_configs.pop(guild.id, None)
+    _allowed_roles.pop(guild.id, None)
+
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    cfg = await _guild_config(channel.guild.id)
+    if channel.id not in (cfg.vc_channel_id, cfg.text_channel_id, cfg.now_playing_channel_id):
+        return
+    if channel.id == cfg.now_playing_channel_id:
+        cfg.now_playing_channel_id = 0
+        cfg.now_playing_message_id = 0
+        _stop_now_playing(_session(channel.guild))
+        _session(channel.guild).np_message = None
+    if channel.id == cfg.vc_channel_id:
+        cfg.vc_channel_id = 0
+    if channel.id == cfg.text_channel_id:
+        # Inaczej komendy nie działałyby nigdzie.
+        cfg.text_channel_id = 0
+    print(f"Usunięto skonfigurowany kanał {channel.id} na serwerze {channel.guild.id}; konfiguracja wyczyszczona")
+    try:
+        await _save_guild_config(channel.guild.id)
+    except Exception as e:
+        print(f"Nie udało się zapisać konfiguracji serwera {channel.guild.id}: {e}")
+
+
 @bot.event
 async def on_wavelink_track_end(payload: wavelink.TrackEndEventPayload):
     # Automatyczne przejście do następnego utworu / loop.
     try:
-        await play_next(payload.player.guild)
+        await _advance_after(payload, "end")
     except Exception as e:
         print(f"Błąd play_next po zakończeniu utworu: {e}")
 
@@ -402,7 +1300,7 @@ async def on_wavelink_track_exception(payload: wavelink.TrackExceptionEventPaylo
     # Gdy track wywali wyjątek, próbuj przejść dalej.
     try:
         print(f"Track exception: {payload.exception}")
-        await play_next(payload.player.guild)
+        await _advance_after(payload, "exception")
     except Exception as e:
         print(f"Błąd play_next po track_exception: {e}")
 
@@ -412,49 +1310,125 @@ async def on_wavelink_track_stuck(payload: wavelink.TrackStuckEventPayload):
     # Gdy track utknie, przełącz dalej.
     try:
         print(f"Track stuck: threshold={payload.threshold}")
-        await play_next(payload.player.guild)
+        await _advance_after(payload, "stuck")
     except Exception as e:
         print(f"Błąd play_next po track_stuck: {e}")
 
 
 @bot.event
 async def on_wavelink_node_disconnected(node: wavelink.Node, _):
+    _node_dropped_at.setdefault(node.identifier, time.monotonic())
     print(f"Lavalink node rozłączony: {node.identifier}")
 
+
+@bot.event
+async def on_wavelink_node_ready(payload: wavelink.NodeReadyEventPayload):
+    """Po ponownym połączeniu: wznowiona sesja -> dosynchronizuj playery z REST zamiast tworzyć nowe."""
+    node = payload.node
+    first = node.identifier not in _nodes_seen
+    _nodes_seen.add(node.identifier)
+    dropped = _node_dropped_at.pop(node.identifier, None)
+    if first:
+        return
+
+    took = f" po {(time.monotonic() - dropped) * 1000:.0f} ms" if dropped is not None else ""
+    if not payload.resumed:
+        _inc("lavalink_reconnects_total", result="new_session")
+        print(f"Lavalink {node.identifier}: nowa sesja{took} – poprzednie playery przepadły (sprawdź LAVALINK_RESUME_TIMEOUT)")
+        return
+
+    _inc("lavalink_reconnects_total", result="resumed")
+    try:
+        infos = await node.fetch_players()
+    except Exception as e:
+        print(f"Lavalink {node.identifier}: wznowiono sesję, ale nie udało się pobrać playerów: {e}")
+        return
+
+    for info in infos:
+        try:
+            await _resync_player(node, info)
+        except Exception as e:
+            print(f"Błąd synchronizacji playera guild={info.guild_id}: {e}")
+    print(f"Lavalink {node.identifier}: wznowiono sesję{took}, zsynchronizowano {len(infos)} playerów")
+
+
+async def _resync_player(node: wavelink.Node, info: wavelink.PlayerResponsePayload):
+    guild = bot.get_guild(info.guild_id)
+    player = node.get_player(info.guild_id)
+    if guild is None or player is None:
+        return
+
+    session = _session(guild)
+    async with session.lock:
+        _sync_player_state(player, info)
+
+        # Zdarzenia z przerwy Lavalink dośle po wznowieniu (przejdą przez _advance_after),
+        # więc tu tylko wyrównujemy bieżący utwór.
+        current = session.current_track
+        if info.track is not None and getattr(current, "encoded", None) != info.track.encoded:
+            session.current_track = info.track
+            session.transition = TRANSITION_PLAYING
+
+
+def _sync_player_state(player: wavelink.Player, info: wavelink.PlayerResponsePayload):
+    """Lokalna pozycja i pauza playera wg stanu z REST – bez żadnego zapytania do Lavalinka.
+
+    wavelink nie ma na to publicznych setterów (`pause()` wysłałby zbędny PATCH), więc używamy tych samych pól,
+    które wavelink ustawia przy każdym playerUpdate z websocketu. Sprawdzone z wavelink==3.4.1 (przypięte
+    w requirements.txt); jeśli ich zabraknie, pozycję wyrówna najbliższy playerUpdate, a pauzę tylko logujemy.
+    """
+    state = info.state
+    if hasattr(player, "_last_position") and hasattr(player, "_last_update"):
+        # Jak w Player._update_event: znacznik z zegara monotonicznego (ns), nie `state.time` Lavalinka.
+        player._last_position = state.position
+        player._last_update = time.monotonic_ns()
+    else:
+        print(f"wavelink bez _last_position/_last_update – pozycja guild={info.guild_id} po najbliższym playerUpdate")
+    if player.paused != info.paused:
+        if hasattr(player, "_paused"):
+            player._paused = info.paused
+        else:
+            print(f"Pauza guild={info.guild_id} rozjechana z Lavalinkiem (lokalnie {player.paused}, node {info.paused})")
+
 # ==========================
 # CONFIG COMMANDS
 # ==========================
-@bot.command()
+@bot.hybrid_command()
 @role_only()
 async def set_vc(ctx, channel: discord.VoiceChannel):
     """Ustaw kanał VC, na którym bot będzie działał"""
-    global VC_CHANNEL_ID
-    VC_CHANNEL_ID = channel.id
+    cfg = await _guild_config(ctx.guild.id)
+    cfg.vc_channel_id = channel.id
+    await _save_guild_config(ctx.guild.id)
     await ctx.send(f"VC ustawiony na: {channel.name}")
 
 
-@bot.command()
+@bot.hybrid_command()
 @role_only()
 async def set_text(ctx, channel: discord.TextChannel):
     """Ustaw kanał tekstowy, w którym komendy będą działały"""
-    global TEXT_CHANNEL_ID
-    TEXT_CHANNEL_ID = channel.id
+    cfg = await _guild_config(ctx.guild.id)
+    cfg.text_channel_id = channel.id
+    await _save_guild_config(ctx.guild.id)
     await ctx.send(f"Kanał tekstowy ustawiony na: {channel.name}")
 
 
-@bot.command()
-@role_only()
+@bot.hybrid_command()
+@role_only(admins=True)
 async def set_role(ctx, role: discord.Role):
     """Ustaw rolę, która będzie mogła używać komend"""
-    global ALLOWED_ROLE_NAME
-    ALLOWED_ROLE_NAME = role.name
+    cfg = await _guild_config(ctx.guild.id)
+    cfg.allowed_role_id = role.id
+    cfg.allowed_role_name = role.name
+    await _save_guild_config(ctx.guild.id)
     await ctx.send(f"Rola ustawiona na: {role.name}")
 
 # ==========================
 # MUSIC COMMANDS
 # ==========================
-@bot.command(name="play", aliases=["p", "add"])
+@bot.hybrid_command(name="play", aliases=["p", "add"])
 @role_only()
+@admission()
 async def play(ctx, *, query: str = ""):
     """Dodaje utwór do kolejki (URL lub fraza) i startuje odtwarzanie."""
     query = (query or "").strip()
@@ -469,130 +1443,218 @@ async def play(ctx, *, query: str = ""):
         )
         return await _safe_send(ctx, embed=e)
 
+    # Pełna kolejka -> odmowa jeszcze przed wyszukiwaniem (QuotaExceeded obsługuje on_command_error).
+    _check_queue_quota(_session(ctx.guild))
+
     player = await ensure_connected(ctx)
     if not player:
         return
 
-    try:
-        track = await _search_track(query)
-    except Exception as e:
-        print(f"Błąd w !play (search) dla '{query}': {type(e).__name__}: {e}")
-        return await _safe_send(ctx, embed=_music_embed("Błąd", "Nie udało się wyszukać utworu (błąd po stronie Lavalink/Wavelink)."))
+    async with _search_slot(ctx.guild.id):
+        try:
+            track = await _search_track(query)
+        except Exception as e:
+            print(f"Błąd w !play (search) dla '{query}': {type(e).__name__}: {e}")
+            return await _safe_send(ctx, embed=_music_embed("Błąd", "Nie udało się wyszukać utworu (błąd po stronie Lavalink/Wavelink)."))
 
     if not track:
         await _safe_send(ctx, embed=_music_embed("Szukaj", f"**Nie znaleziono utworu** dla: `{query}`"))
         return
 
     try:
-        await enqueue_and_maybe_play(ctx, player, track)
+        async with _session(ctx.guild).lock:
+            await enqueue_and_maybe_play(ctx, player, track)
+    except QuotaExceeded:
+        raise
     except Exception as e:
         print(f"Błąd w !play (enqueue/play) dla '{query}': {type(e).__name__}: {e}")
         await _safe_send(ctx, embed=_music_embed("Błąd", "Nie udało się dodać/odtworzyć utworu."))
 
 
-@bot.command()
+@bot.hybrid_command(extras={"instant": True})
 @role_only()
 async def now(ctx):
     """Pokazuje aktualnie odtwarzany utwór."""
-    if not current_track:
+    session = _session(ctx.guild)
+    cfg = await _guild_config(ctx.guild.id)
+    message = _now_playing_message(session, cfg) if cfg.now_playing_channel_id else None
+    if message is not None:
+        # Żywa wiadomość już to pokazuje – zamiast nowego embeda tylko odśwież ją i podlinkuj.
+        session.np_dirty.set()
+        await _ensure_now_playing(ctx.guild)
+        return await _safe_send(ctx, content=f"Teraz gra: {message.jump_url}", ephemeral=True)
+
+    if not session.current_track:
         return await ctx.send(embed=_music_embed("Teraz gra", "Aktualnie nic nie gra."))
 
-    e = _music_embed("Teraz gra", _track_line(current_track))
+    r = _render_track(session.current_track)
+    e = _music_embed("Teraz gra", r.line)
 
-    dur = _track_duration_ms(current_track)
-    if dur:
-        e.add_field(name="Długość", value=_format_duration_ms(dur), inline=True)
+    if r.duration:
+        e.add_field(name="Długość", value=r.duration, inline=True)
 
-    thumb = _guess_youtube_thumbnail(_track_url(current_track))
-    if thumb:
-        e.set_thumbnail(url=thumb)
+    if r.thumbnail:
+        e.set_thumbnail(url=r.thumbnail)
 
     await ctx.send(embed=e)
 
 
-@bot.command()
+@bot.hybrid_command(name="queue", aliases=["queue_show"], extras={"instant": True})
 @role_only()
 async def queue_show(ctx):
     """Pokazuje kolejkę."""
     player = await _get_player(ctx.guild)
+    session = _session(ctx.guild)
 
-    if not queue and not current_track:
+    if not session.queue and not session.current_track:
         return await ctx.send(embed=_music_embed("Kolejka", "Kolejka jest pusta."))
 
+    # Długa kolejka -> stronicowany widok; krótka -> podgląd z cache.
+    if len(session.queue) > QUEUE_PREVIEW_SIZE:
+        return await _send_paged(ctx, _QueuePages(ctx.guild.id), len(session.queue))
+
     e = _music_embed("Kolejka")
 
-    if current_track:
-        e.add_field(name="Teraz gra", value=_track_line(current_track), inline=False)
-
-    if queue:
-        preview = []
-        for i, t in enumerate(list(queue)[:10], start=1):
-            preview.append(f"{i}. {_track_line(t)}")
-        more = len(queue) - 10
-        if more > 0:
-            preview.append(f"… (+{more} więcej)")
-        e.add_field(name="Następne", value="\n".join(preview), inline=False)
-    else:
-        e.add_field(name="Następne", value="(brak)", inline=False)
+    if session.current_track:
+        e.add_field(name="Teraz gra", value=_render_track(session.current_track).line, inline=False)
 
-    if player:
-        status = "pauza" if player.paused else "gra" if player.playing else "stop"
-        e.set_footer(text=f"Status: {status} • Loop: {loop_mode}")
-    else:
-        e.set_footer(text=f"Loop: {loop_mode}")
+    e.add_field(name="Następne", value=_queue_preview(session), inline=False)
+    e.set_footer(text=_queue_status(session, player))
 
     await ctx.send(embed=e)
 
 
-@bot.command()
+@bot.hybrid_command()
 @role_only()
 async def pause(ctx):
-    player = await _get_player(ctx.guild)
-    if player and player.playing:
+    """Wstrzymuje odtwarzanie."""
+    async with _session(ctx.guild).lock:
+        player = await _get_player(ctx.guild)
+        if not (player and player.playing):
+            return
         await player.pause(True)
-        await ctx.send(embed=_music_embed("Pauza", "Odtwarzanie wstrzymane."))
+        _session(ctx.guild).np_dirty.set()
+    await ctx.send(embed=_music_embed("Pauza", "Odtwarzanie wstrzymane."))
 
 
-@bot.command()
+@bot.hybrid_command()
 @role_only()
 async def resume(ctx):
-    player = await _get_player(ctx.guild)
-    if player and player.paused:
+    """Wznawia odtwarzanie."""
+    async with _session(ctx.guild).lock:
+        player = await _get_player(ctx.guild)
+        if not (player and player.paused):
+            return
         await player.pause(False)
-        await ctx.send(embed=_music_embed("Wznowiono", "Odtwarzanie wznowione."))
+        _session(ctx.guild).np_dirty.set()
+    await ctx.send(embed=_music_embed("Wznowiono", "Odtwarzanie wznowione."))
 
 
-@bot.command()
+@bot.hybrid_command()
 @role_only()
 async def skip(ctx):
-    player = await _get_player(ctx.guild)
-    if not player:
-        return
-    await player.stop()
+    """Pomija aktualny utwór."""
+    async with _session(ctx.guild).lock:
+        player = await _get_player(ctx.guild)
+        if not player:
+            return
+        await player.stop()
     await ctx.send(embed=_music_embed("Pominięto", "Utwór został pominięty."))
 
 
-@bot.command()
+@bot.hybrid_command()
 @role_only()
 async def stop(ctx):
-    player = await _get_player(ctx.guild)
-    if player:
-        await player.stop()
-    queue.clear()
-    global current_track
-    current_track = None
-
-    # skoro stop i pusto, to zaplanuj rozłączenie
-    _schedule_idle_disconnect(ctx.guild)
+    """Zatrzymuje odtwarzanie i czyści kolejkę."""
+    session = _session(ctx.guild)
+    async with session.lock:
+        player = await _get_player(ctx.guild)
+        if player:
+            await player.stop()
+        if session.current_track is not None:
+            _remember_played(session, session.current_track)
+        session.queue.clear()
+        session.queue_changed()
+        session.current_track = None
+        session.transition = TRANSITION_IDLE
+
+        # skoro stop i pusto, to zaplanuj rozłączenie
+        _schedule_idle_disconnect(ctx.guild)
 
     await ctx.send(embed=_music_embed("Zatrzymano", "Odtwarzanie zatrzymane, kolejka wyczyszczona."))
 
+
+@bot.hybrid_command(name="history", aliases=["hist"], extras={"instant": True})
+@role_only()
+async def history(ctx):
+    """Pokazuje ostatnio odtworzone utwory."""
+    session = _session(ctx.guild)
+    if not session.history:
+        return await ctx.send(embed=_music_embed("Historia", "Nic jeszcze nie grało."))
+
+    lines = []
+    for i, raw in enumerate(islice(reversed(session.history), 10), start=1):
+        lines.append(f"{i}. {_history_line(raw)}")
+    more = len(session.history) - 10
+    if more > 0:
+        lines.append(f"… (+{more} starszych)")
+
+    e = _music_embed("Historia", "\n".join(lines))
+    e.set_footer(text="!back <nr> — dodaj ponownie (1 = ostatni)")
+    await ctx.send(embed=e)
+
+
+@bot.hybrid_command(name="back", aliases=["prev", "replay"])
+@role_only()
+async def back(ctx, index: int = 1):
+    """Dodaje utwór z historii na początek kolejki (bez wyszukiwania w Lavalinku)."""
+    session = _session(ctx.guild)
+    if not 1 <= index <= len(session.history):
+        return await _safe_send(ctx, embed=_music_embed("Historia", "**Nie ma takiej pozycji w historii.**\nZobacz: `!history`"))
+
+    player = await ensure_connected(ctx)
+    if not player:
+        return
+
+    raw = session.history[-index]
+    track = wavelink.Playable(raw)
+    async with session.lock:
+        _check_queue_quota(session, [track])
+        session.queue.appendleft(track)
+        session.queue_changed()
+        _cancel_idle_task(session)
+        await _safe_send(ctx, embed=_music_embed("Z historii", f"Następny: {_render_track(track).line}"))
+
+        if not player.playing and not player.paused:
+            await play_next(ctx.guild)
+
+
+def _history_line(raw: dict) -> str:
+    info = raw.get("info") or {}
+    title = info.get("title") or "?"
+    uri = info.get("uri")
+    return f"[{title}]({uri})" if uri else str(title)
+
 # ==========================
 # PLAYLIST MANAGEMENT
 # ==========================
-@bot.command(name="playlist_create", aliases=["pl_create"])
+# Długie operacje (np. `playlist_play`) pokazują postęp edycjami jednej wiadomości, nie częściej niż co tyle sekund.
+PROGRESS_EDIT_INTERVAL_SECONDS = float(os.environ.get("PROGRESS_EDIT_INTERVAL_SECONDS", "1.5"))
+
+
+async def _edit_progress(message, embed: discord.Embed) -> bool:
+    try:
+        await message.edit(embed=embed)
+        return True
+    except Exception as e:
+        print(f"Nie udało się zaktualizować postępu: {e}")
+        return False
+
+
+@bot.hybrid_command(name="playlist_create", aliases=["pl_create"])
 @role_only()
 async def playlist_create(ctx, *, name: str):
+    """Tworzy nową playlistę."""
     name = (name or "").strip()
     if not name:
         return await _safe_send(
@@ -602,27 +1664,31 @@ async def playlist_create(ctx, *, name: str):
                 "**Musisz podać nazwę playlisty.**\nPrzykład: `!playlist_create dark ambient`",
             ),
         )
-    if name in playlists:
+    if await playlist_exists(name):
         return await _safe_send(ctx, embed=_music_embed("Playlisty", f"Playlista **{name}** już istnieje."))
-    playlists[name] = []
-    save_playlists()
+    await store.sadd(_PLAYLIST_INDEX_KEY, name)
+    await _playlist_owner(name, claim_for=ctx.guild.id)
     await _safe_send(ctx, embed=_music_embed("Playlisty", f"Utworzono playlistę: **{name}**"))
 
 
-@bot.command(name="playlist_list")
+@bot.hybrid_command(name="playlist_list")
 @role_only()
 async def playlist_list(ctx):
-    if not playlists:
+    """Pokazuje listę playlist."""
+    names = await playlist_names()
+    if not names:
         return await ctx.send(embed=_music_embed("Playlisty", "Brak playlist."))
 
+    counts = [await store.llen(_playlist_key(name)) for name in names]
     e = _music_embed("Playlisty")
-    e.description = "\n".join(f"• **{name}** ({len(items)} pozycji)" for name, items in sorted(playlists.items()))
+    e.description = "\n".join(f"• **{name}** ({count} pozycji)" for name, count in zip(names, counts))
     await ctx.send(embed=e)
 
 
-@bot.command(name="playlist_add", aliases=["pl_add"])
+@bot.hybrid_command(name="playlist_add", aliases=["pl_add"])
 @role_only()
 async def playlist_add(ctx, playlist_name: str, *, query: str):
+    """Dodaje wpis (frazę lub link) do playlisty."""
     playlist_name = (playlist_name or "").strip()
     query = (query or "").strip()
 
@@ -636,17 +1702,19 @@ async def playlist_add(ctx, playlist_name: str, *, query: str):
             ),
         )
 
-    if playlist_name not in playlists:
+    if not await playlist_exists(playlist_name):
         return await _safe_send(ctx, embed=_music_embed("Playlisty", "**Nie znaleziono takiej playlisty.**"))
 
-    playlists[playlist_name].append(query)
-    save_playlists()
+    owner = await _playlist_owner(playlist_name, claim_for=ctx.guild.id)
+    if not await _push_entries(owner, _playlist_key(playlist_name), [query]):
+        raise QuotaExceeded("storage", _storage_usage[owner], QUOTA_STORAGE_BYTES)
     await _safe_send(ctx, embed=_music_embed("Playlisty", f"Dodano do **{playlist_name}**:\n`{query}`"))
 
 
-@bot.command(name="playlist_remove", aliases=["pl_remove", "pl_del"])
+@bot.hybrid_command(name="playlist_remove", aliases=["pl_remove", "pl_del"])
 @role_only()
 async def playlist_remove(ctx, playlist_name: str = None, *, query: str = None):
+    """Usuwa wpis z playlisty."""
     playlist_name = (playlist_name or "").strip()
     query = (query or "").strip()
 
@@ -660,48 +1728,47 @@ async def playlist_remove(ctx, playlist_name: str = None, *, query: str = None):
             ),
         )
 
-    if playlist_name not in playlists:
+    if not await playlist_exists(playlist_name):
         return await _safe_send(ctx, embed=_music_embed("Playlisty", "**Nie znaleziono takiej playlisty.**"))
 
     # Usuń pierwsze pasujące wystąpienie (case-insensitive), żeby UX był lepszy.
-    items = playlists[playlist_name]
+    key = _playlist_key(playlist_name)
+    items = await store.lrange(key, 0, await store.llen(key))
     idx = next((i for i, it in enumerate(items) if it.lower() == query.lower()), None)
     if idx is None:
         return await _safe_send(ctx, embed=_music_embed("Playlisty", "**Ten wpis nie istnieje w playlistie.**"))
 
-    removed = items.pop(idx)
-    save_playlists()
+    removed = items[idx]
+    await store.ldel_index(key, idx)
+    owner = await _playlist_owner(playlist_name)
+    if owner is not None:
+        await _charge_storage(owner, -_entry_bytes(removed))
     await _safe_send(ctx, embed=_music_embed("Playlisty", f"Usunięto z **{playlist_name}**:\n`{removed}`"))
 
 
-@bot.command(name="playlist_show", aliases=["pl_show"])
+@bot.hybrid_command(name="playlist_show", aliases=["pl_show"])
 @role_only()
 async def playlist_show(ctx, *, playlist_name: str):
+    """Pokazuje zawartość playlisty."""
     playlist_name = (playlist_name or "").strip()
     if not playlist_name:
         return await _safe_send(ctx, embed=_music_embed("Playlisty", "**Musisz podać nazwę playlisty.**"))
 
-    if playlist_name not in playlists:
+    if not await playlist_exists(playlist_name):
         return await _safe_send(ctx, embed=_music_embed("Playlista", "Nie znaleziono takiej playlisty."))
 
-    items = playlists[playlist_name]
-    e = _music_embed(f"Playlista: {playlist_name}")
-
-    if not items:
-        e.description = "Playlista jest pusta."
-        return await _safe_send(ctx, embed=e)
-
-    preview = "\n".join(f"{i+1}. {q}" for i, q in enumerate(items[:15]))
-    if len(items) > 15:
-        preview += f"\n… (+{len(items)-15} więcej)"
+    total = await store.llen(_playlist_key(playlist_name))
+    if not total:
+        return await _safe_send(ctx, embed=_music_embed(f"Playlista: {playlist_name}", "Playlista jest pusta."))
 
-    e.description = preview
-    await _safe_send(ctx, embed=e)
+    await _send_paged(ctx, _PlaylistPages(playlist_name), total)
 
 
-@bot.command(name="playlist_play", aliases=["pl_play", "pl"])
+@bot.hybrid_command(name="playlist_play", aliases=["pl_play", "pl"])
 @role_only()
+@admission(cost=ADMISSION_PLAYLIST_COST)
 async def playlist_play(ctx, *, playlist_name: str):
+    """Dodaje całą playlistę do kolejki."""
     playlist_name = (playlist_name or "").strip()
     if not playlist_name:
         return await _safe_send(
@@ -712,47 +1779,298 @@ async def playlist_play(ctx, *, playlist_name: str):
             ),
         )
 
-    if playlist_name not in playlists:
+    if not await playlist_exists(playlist_name):
         return await _safe_send(ctx, embed=_music_embed("Playlista", "Nie znaleziono takiej playlisty."))
 
     player = await ensure_connected(ctx)
     if not player:
         return
 
-    items = playlists[playlist_name]
-    if not items:
+    session = _session(ctx.guild)
+    _check_queue_quota(session)
+
+    key = _playlist_key(playlist_name)
+    total = await store.llen(key)
+    if not total:
         return await _safe_send(ctx, embed=_music_embed("Playlista", "Playlista jest pusta."))
+    # Nie szukamy więcej, niż zmieści kolejka.
+    room = _queue_room(session)
+    items = await store.lrange(key, 0, total if room is None else min(total, room))
+
+    # Wyszukiwanie poza blokadą – `!skip`/`!stop` nie czekają na całą playlistę.
+    # Postęp idzie edycjami jednej wiadomości, najwyżej raz na PROGRESS_EDIT_INTERVAL_SECONDS.
+    title = f"Playlista: {playlist_name}"
+    progress = None
+    tracks = []
+    async with _search_slot(ctx.guild.id):
+        if len(items) > 1:
+            progress = await _safe_send(ctx, embed=_music_embed(title, f"Szukam utworów: **0**/**{len(items)}**"))
+        last_edit = time.monotonic()
+        for done, q in enumerate(items, start=1):
+            track = await _search_track(q)
+            if track:
+                tracks.append(track)
+            if progress is not None and done < len(items) and time.monotonic() - last_edit >= PROGRESS_EDIT_INTERVAL_SECONDS:
+                last_edit = time.monotonic()
+                await _edit_progress(progress, _music_embed(title, f"Szukam utworów: **{done}**/**{len(items)}** (znaleziono {len(tracks)})"))
+
+    async with session.lock:
+        # W międzyczasie kolejka mogła urosnąć – dodajemy tyle, ile się mieści.
+        try:
+            fits = _check_queue_quota(session, tracks) if tracks else 0
+        except QuotaExceeded as error:
+            # Odpowiedź podmienia wiadomość z postępem – inaczej zostałaby na "Szukam…".
+            if progress is None:
+                raise
+            _inc("quota_rejections_total", resource=error.resource)
+            if not await _edit_progress(progress, _quota_message(error)):
+                await _safe_send(ctx, embed=_quota_message(error))
+            return
+        session.queue.extend(tracks[:fits])
+        session.queue_changed()
 
-    added = 0
-    for q in items:
-        track = await _search_track(q)
-        if track:
-            queue.append(track)
-            added += 1
+        e = _music_embed(f"Dodano playlistę: {playlist_name}", f"Dodano do kolejki: **{fits}**/**{total}**")
+        if fits < total and (len(items) < total or fits < len(tracks)):
+            e.add_field(name="Limit serwera", value="Kolejka jest pełna – resztę pominięto.", inline=False)
+        e.add_field(name="Kolejka", value=str(len(session.queue)), inline=True)
+        if progress is None or not await _edit_progress(progress, e):
+            await _safe_send(ctx, embed=e)
 
-    e = _music_embed(f"Dodano playlistę: {playlist_name}", f"Dodano do kolejki: **{added}**/**{len(items)}**")
-    e.add_field(name="Kolejka", value=str(len(queue)), inline=True)
-    await _safe_send(ctx, embed=e)
-
-    if not player.playing and not player.paused:
-        await play_next(ctx.guild)
+        if not player.playing and not player.paused:
+            await play_next(ctx.guild)
 
 # ==========================
-# LOOP MODES
+# PLAYLIST IMPORT / EXPORT
 # ==========================
-LOOP_OFF = "off"
-LOOP_SONG = "song"
-LOOP_QUEUE = "queue"
+# Plik z załącznika czytany strumieniowo (linia po linii), zapis do magazynu partiami.
+IMPORT_MAX_BYTES = int(os.environ.get("IMPORT_MAX_BYTES", str(20 * 1024 * 1024)))
+IMPORT_BATCH_SIZE = 500
+_IMPORT_ENTRY_MAX_LEN = 500
+_EXPORT_CHUNK = 1000
+_JSON_ELEMENT_MAX_CHARS = 64 * 1024
+
+
+def _normalize_entry(q: str) -> str:
+    return " ".join(q.split()).casefold()
+
+
+async def _attachment_chunks(attachment: discord.Attachment):
+    """Tekst załącznika pobierany kawałkami – plik nigdy nie jest w pamięci w całości."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    async with aiohttp.ClientSession() as http:
+        async with http.get(attachment.url) as resp:
+            resp.raise_for_status()
+            async for raw in resp.content.iter_chunked(64 * 1024):
+                yield decoder.decode(raw)
+    yield decoder.decode(b"", final=True)
+
+
+async def _lines(chunks):
+    rest = ""
+    async for chunk in chunks:
+        rest += chunk
+        *complete, rest = rest.split("\n")
+        for line in complete:
+            yield line.rstrip("\r")
+        # Bardzo długa "linia" to nie jest wpis playlisty – ucinamy zamiast buforować.
+        rest = rest[:_IMPORT_ENTRY_MAX_LEN * 4]
+    if rest:
+        yield rest.rstrip("\r")
+
+
+async def _entries_text(chunks):
+    async for line in _lines(chunks):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+async def _entries_csv(chunks):
+    column = 0
+    first = True
+    async for line in _lines(chunks):
+        if not line.strip():
+            continue
+        row = next(csv.reader([line]), [])
+        if first:
+            first = False
+            header = [c.strip().lower() for c in row]
+            named = next((header.index(c) for c in ("query", "url", "uri", "title") if c in header), None)
+            if named is not None:
+                column = named
+                continue
+        if column < len(row) and row[column].strip():
+            yield row[column].strip()
+
+
+def _json_entry(item) -> Optional[str]:
+    if isinstance(item, str):
+        return item
+    if isinstance(item, dict):
+        for k in ("query", "url", "uri", "title"):
+            if isinstance(item.get(k), str):
+                return item[k]
+    return None
+
+
+async def _entries_json(chunks):
+    """Tablica JSON (przyrostowo, element po elemencie) albo JSON Lines."""
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    started = False
+    async for chunk in chunks:
+        buf = buf[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started and buf[pos] == "[":
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if len(buf) - pos > _JSON_ELEMENT_MAX_CHARS:
+                    raise ValueError("Niepoprawny JSON")
+                break  # element niepełny – dociągnij kolejny kawałek
+            entry = _json_entry(item)
+            if entry:
+                yield entry
+    if buf[pos:].strip():
+        raise ValueError("Niepoprawny lub ucięty JSON")
+
+
+@bot.hybrid_command(name="playlist_import", aliases=["pl_import"])
+@app_commands.rename(attachment="plik")
+@role_only()
+@admission(cost=ADMISSION_PLAYLIST_COST)
+async def playlist_import(ctx, attachment: Optional[discord.Attachment] = None, *, playlist_name: str = ""):
+    """Import wpisów z załącznika .txt / .csv / .json(l) do playlisty (tworzy ją, jeśli nie istnieje)."""
+    playlist_name = (playlist_name or "").strip()
+    if not playlist_name or attachment is None:
+        return await _safe_send(
+            ctx,
+            embed=_music_embed(
+                "Import",
+                "**Podaj nazwę playlisty i dołącz plik** (.txt — wpis na linię, .csv, .json/.jsonl).\n"
+                "Przykład: `!playlist_import moja_playlista` + załącznik",
+            ),
+        )
+    if attachment.size > IMPORT_MAX_BYTES:
+        return await _safe_send(ctx, embed=_music_embed("Import", f"Plik jest za duży (limit {IMPORT_MAX_BYTES // 1024 // 1024} MB)."))
+
+    ext = os.path.splitext(attachment.filename.lower())[1]
+    parser = {".csv": _entries_csv, ".json": _entries_json, ".jsonl": _entries_json}.get(ext, _entries_text)
+
+    key = _playlist_key(playlist_name)
+    await store.sadd(_PLAYLIST_INDEX_KEY, playlist_name)
+    owner = await _playlist_owner(playlist_name, claim_for=ctx.guild.id)
+
+    # Klucze istniejących wpisów (kawałkami), żeby nie dublować.
+    seen: set[str] = set()
+    total = await store.llen(key)
+    for start in range(0, total, _EXPORT_CHUNK):
+        seen.update(_normalize_entry(q) for q in await store.lrange(key, start, start + _EXPORT_CHUNK))
+
+    added = skipped = 0
+    full = False
+    batch: list[str] = []
+    try:
+        async for entry in parser(_attachment_chunks(attachment)):
+            entry = entry[:_IMPORT_ENTRY_MAX_LEN]
+            norm = _normalize_entry(entry)
+            if not norm or norm in seen:
+                skipped += 1
+                continue
+            seen.add(norm)
+            batch.append(entry)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                pushed = await _push_entries(owner, key, batch)
+                added += pushed
+                full = pushed < len(batch)
+                batch = []
+                if full:
+                    break
+        if batch and not full:
+            pushed = await _push_entries(owner, key, batch)
+            added += pushed
+            full = pushed < len(batch)
+    except Exception as e:
+        print(f"Błąd importu playlisty '{playlist_name}': {type(e).__name__}: {e}")
+        return await _safe_send(
+            ctx,
+            embed=_music_embed("Import", f"Import przerwany ({type(e).__name__}). Zapisano **{added}** wpisów przed błędem."),
+        )
+
+    e = _music_embed("Import", f"**{playlist_name}**: dodano **{added}**, pominięto duplikaty/puste: **{skipped}**.")
+    if full:
+        e.add_field(
+            name="Limit serwera",
+            value=f"Skończyło się miejsce na playlisty ({_format_bytes(QUOTA_STORAGE_BYTES)}) – reszta pliku nie została zaimportowana.",
+            inline=False,
+        )
+    await _safe_send(ctx, embed=e)
+
 
-loop_mode: str = LOOP_OFF
+@bot.hybrid_command(name="playlist_export", aliases=["pl_export"])
+@role_only()
+async def playlist_export(ctx, playlist_name: str = "", fmt: str = "txt"):
+    """Eksport playlisty jako załącznik (.txt albo .json)."""
+    playlist_name = (playlist_name or "").strip()
+    fmt = (fmt or "txt").strip().lower()
+    if not playlist_name or fmt not in ("txt", "json"):
+        return await _safe_send(ctx, embed=_music_embed("Eksport", "Użyj: `!playlist_export <nazwa> [txt|json]`"))
+    if not await playlist_exists(playlist_name):
+        return await _safe_send(ctx, embed=_music_embed("Playlista", "Nie znaleziono takiej playlisty."))
 
+    key = _playlist_key(playlist_name)
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        # Zapis kawałkami: magazyn -> plik tymczasowy (w wątku), bez trzymania całej listy.
+        with open(path, "w", encoding="utf-8") as f:
+            if fmt == "json":
+                await asyncio.to_thread(f.write, "[\n")
+            start = 0
+            while True:
+                chunk = await store.lrange(key, start, start + _EXPORT_CHUNK)
+                if not chunk:
+                    break
+                if fmt == "json":
+                    sep = ",\n" if start else ""
+                    text = sep + ",\n".join(json.dumps(q, ensure_ascii=False) for q in chunk)
+                else:
+                    text = "\n".join(chunk) + "\n"
+                await asyncio.to_thread(f.write, text)
+                start += len(chunk)
+            if fmt == "json":
+                await asyncio.to_thread(f.write, "\n]\n")
+
+        safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in playlist_name) or "playlist"
+        await _safe_send(
+            ctx,
+            embed=_music_embed("Eksport", f"**{playlist_name}**: {start} wpisów."),
+            file=discord.File(path, filename=f"{safe_name}.{fmt}"),
+        )
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
 
-@bot.command()
+# ==========================
+# LOOP MODES
+# ==========================
+@bot.hybrid_command()
 @role_only()
 async def loop(ctx, mode: str = "off"):
     """Ustawia zapętlanie: off | song | queue"""
-    global loop_mode
-
     mode = (mode or "").strip().lower()
     if mode in ("0", "false", "none"):
         mode = LOOP_OFF
@@ -761,11 +2079,12 @@ async def loop(ctx, mode: str = "off"):
         e = _music_embed("Loop", "Użyj: `!loop off` / `!loop song` / `!loop queue`")
         return await ctx.send(embed=e)
 
-    loop_mode = mode
+    async with _session(ctx.guild).lock:
+        _session(ctx.guild).loop_mode = mode
 
-    if loop_mode == LOOP_OFF:
+    if mode == LOOP_OFF:
         msg = "Wyłączono zapętlanie."
-    elif loop_mode == LOOP_SONG:
+    elif mode == LOOP_SONG:
         msg = "Włączono zapętlanie utworu (loop song)."
     else:
         msg = "Włączono zapętlanie kolejki (loop queue)."
@@ -773,11 +2092,11 @@ async def loop(ctx, mode: str = "off"):
     await ctx.send(embed=_music_embed("Loop", msg))
 
 
-@bot.command()
+@bot.hybrid_command(extras={"instant": True})
 @role_only()
 async def loop_status(ctx):
     """Pokazuje aktualny tryb zapętlania."""
-    await ctx.send(embed=_music_embed("Loop", f"Aktualny tryb: **{loop_mode}**"))
+    await ctx.send(embed=_music_embed("Loop", f"Aktualny tryb: **{_session(ctx.guild).loop_mode}**"))
 
 # ==========================
 # EMBEDS
@@ -835,11 +2154,424 @@ def _track_url(track: wavelink.Playable) -> Optional[str]:
     return getattr(track, "uri", None) or getattr(track, "url", None)
 
 
+# ==========================
+# RENDER CACHE
+# ==========================
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", "512"))
+QUEUE_PREVIEW_SIZE = 10
+
+
+class _TrackRender(NamedTuple):
+    line: str
+    duration: Optional[str]
+    thumbnail: Optional[str]
+
+
+# identifier -> gotowe fragmenty embeda (LRU, ograniczony rozmiar)
+_render_cache: OrderedDict[str, _TrackRender] = OrderedDict()
+
+
+def _render_track(track: wavelink.Playable) -> _TrackRender:
+    """Linia, długość i miniatura utworu – liczone raz na identifier."""
+    key = getattr(track, "identifier", None) or _track_url(track)
+    if key:
+        cached = _render_cache.get(key)
+        if cached is not None:
+            _render_cache.move_to_end(key)
+            return cached
+
+    dur = _track_duration_ms(track)
+    r = _TrackRender(
+        line=_track_line(track),
+        duration=_format_duration_ms(dur) if dur else None,
+        thumbnail=_guess_youtube_thumbnail(_track_url(track)),
+    )
+
+    if key and RENDER_CACHE_SIZE > 0:
+        _render_cache[key] = r
+        if len(_render_cache) > RENDER_CACHE_SIZE:
+            _render_cache.popitem(last=False)
+    return r
+
+
+def _refresh_preview(session: GuildSession) -> tuple[int, str, tuple[str, ...]]:
+    """Podgląd kolejki (tekst i linie); przeliczany tylko po zmianie kolejki."""
+    if session.preview_cache[0] == session.queue_version:
+        return session.preview_cache
+
+    queue = session.queue
+    lines = tuple(f"{i}. {_render_track(t).line}" for i, t in enumerate(islice(queue, QUEUE_PREVIEW_SIZE), start=1))
+    if lines:
+        more = len(queue) - QUEUE_PREVIEW_SIZE
+        text = "\n".join(lines + ((f"… (+{more} więcej)",) if more > 0 else ()))
+    else:
+        text = "(brak)"
+
+    session.preview_cache = (session.queue_version, text, lines)
+    return session.preview_cache
+
+
+def _queue_preview(session: GuildSession) -> str:
+    """Tekst pola "Następne"."""
+    return _refresh_preview(session)[1]
+
+
+def _queue_status(session: GuildSession, player: Optional[wavelink.Player]) -> str:
+    if player is None:
+        return f"Loop: {session.loop_mode}"
+    status = "pauza" if player.paused else "gra" if player.playing else "stop"
+    return f"Status: {status} • Loop: {session.loop_mode}"
+
+
 def _track_duration_ms(track: wavelink.Playable) -> Optional[int]:
     # wavelink zwykle trzyma długość w ms jako `length`
     length = getattr(track, "length", None)
     return int(length) if isinstance(length, (int, float)) and length > 0 else None
 
+# ==========================
+# NOW PLAYING (żywa wiadomość)
+# ==========================
+# Jedna wiadomość na serwer, edytowana w miejscu. Zdarzenia (nowy utwór, pauza, zmiana kolejki) tylko
+# ustawiają `session.np_dirty`; jedno zadanie na serwer robi edycje nie częściej niż co
+# NOW_PLAYING_MIN_EDIT_SECONDS (zdarzenia z tego okna scalają się w jedną edycję), a w trakcie grania
+# odświeża pasek postępu co NOW_PLAYING_TICK_SECONDS. Zadanie kończy się, gdy na VC nie ma ludzi.
+NOW_PLAYING_TICK_SECONDS = float(os.environ.get("NOW_PLAYING_TICK_SECONDS", "15"))
+NOW_PLAYING_MIN_EDIT_SECONDS = float(os.environ.get("NOW_PLAYING_MIN_EDIT_SECONDS", "5"))
+_PROGRESS_BAR_WIDTH = 18
+
+
+def _progress_bar(position_ms: int, length_ms: Optional[int]) -> str:
+    if not length_ms:
+        return f"`{_format_duration_ms(position_ms) if position_ms else '0:00'}`"
+    filled = min(_PROGRESS_BAR_WIDTH, int(_PROGRESS_BAR_WIDTH * position_ms / length_ms))
+    bar = "▬" * filled + "🔘" + "─" * (_PROGRESS_BAR_WIDTH - filled)
+    position = _format_duration_ms(position_ms) if position_ms >= 1000 else "0:00"
+    return f"{bar} `{position} / {_format_duration_ms(length_ms)}`"
+
+
+def _now_playing_embed(session: GuildSession, player: Optional[wavelink.Player]) -> discord.Embed:
+    track = session.current_track
+    if track is None or player is None:
+        e = _music_embed("Teraz gra", "Aktualnie nic nie gra.")
+    else:
+        r = _render_track(track)
+        e = _music_embed("Teraz gra", f"{r.line}\n\n{_progress_bar(int(player.position or 0), _track_duration_ms(track))}")
+        if r.thumbnail:
+            e.set_thumbnail(url=r.thumbnail)
+    e.add_field(name="Następne", value=_queue_preview(session), inline=False)
+    status = "pauza" if player and player.paused else "gra" if player and player.playing else "stop"
+    e.set_footer(text=f"Status: {status} • Loop: {session.loop_mode} • W kolejce: {len(session.queue)}")
+    return e
+
+
+async def _ensure_now_playing(guild: discord.Guild):
+    """Uruchamia zadanie żywej wiadomości, jeśli jest włączona i jeszcze nie działa."""
+    cfg = await _guild_config(guild.id)
+    session = _session(guild)
+    if not cfg.now_playing_channel_id or (session.np_task and not session.np_task.done()):
+        return
+    session.np_dirty.set()
+    session.np_task = bot.loop.create_task(_now_playing_loop(guild.id), name=f"now-playing:{guild.id}")
+
+
+def _stop_now_playing(session: GuildSession):
+    if session.np_task and not session.np_task.done():
+        session.np_task.cancel()
+    session.np_task = None
+
+
+def _now_playing_message(session: GuildSession, cfg: GuildConfig) -> Optional[discord.Message | discord.PartialMessage]:
+    if session.np_message is None and cfg.now_playing_message_id:
+        channel = bot.get_channel(cfg.now_playing_channel_id)
+        if channel is not None:
+            session.np_message = channel.get_partial_message(cfg.now_playing_message_id)
+    return session.np_message
+
+
+async def _publish_now_playing(session: GuildSession, embed: discord.Embed):
+    """Edytuje żywą wiadomość; gdy jej nie ma (lub ktoś ją usunął) – wysyła nową."""
+    cfg = await _guild_config(session.guild_id)
+    message = _now_playing_message(session, cfg)
+    if message is not None:
+        try:
+            session.np_message = await message.edit(embed=embed)
+            _inc("now_playing_edits_total", kind="edit")
+            return
+        except discord.NotFound:
+            session.np_message = None
+
+    channel = bot.get_channel(cfg.now_playing_channel_id)
+    if channel is None:
+        return
+    session.np_message = await channel.send(embed=embed)
+    _inc("now_playing_edits_total", kind="send")
+    cfg.now_playing_message_id = session.np_message.id
+    await _save_guild_config(session.guild_id)
+
+
+async def _now_playing_loop(guild_id: int):
+    session = _sessions[guild_id]
+    last_edit = 0.0
+    try:
+        while True:
+            guild = bot.get_guild(guild_id)
+            player = await _get_player(guild) if guild else None
+            ticking = player is not None and player.playing and not player.paused
+            try:
+                # Bez grania czekamy tylko na zdarzenia; w trakcie – także na tyknięcie paska postępu.
+                await asyncio.wait_for(session.np_dirty.wait(), NOW_PLAYING_TICK_SECONDS if ticking else None)
+            except asyncio.TimeoutError:
+                pass
+
+            # Kolejne zdarzenia w oknie limitu scalą się z tą edycją.
+            wait = last_edit + NOW_PLAYING_MIN_EDIT_SECONDS - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            session.np_dirty.clear()
+
+            cfg = await _guild_config(guild_id)
+            if not cfg.now_playing_channel_id:
+                return
+            guild = bot.get_guild(guild_id)
+            player = await _get_player(guild) if guild else None
+            listeners = _real_users(player.channel) if player is not None and player.channel else []
+            if not listeners:
+                # Nikt nie słucha: ostatnia edycja i koniec; `_start_track` uruchomi zadanie ponownie.
+                await _publish_now_playing(session, _now_playing_embed(session, None))
+                return
+
+            await _publish_now_playing(session, _now_playing_embed(session, player))
+            last_edit = time.monotonic()
+    except Exception as e:
+        print(f"Błąd żywej wiadomości 'Teraz gra' (serwer {guild_id}): {type(e).__name__}: {e}")
+
+
+@bot.hybrid_command(name="now_live")
+@role_only()
+async def now_live(ctx, mode: str = "on"):
+    """Włącza/wyłącza żywą wiadomość "Teraz gra" w tym kanale: on | off"""
+    mode = (mode or "").strip().lower()
+    if mode not in ("on", "off"):
+        return await _safe_send(ctx, embed=_music_embed("Teraz gra", "Użyj: `!now_live on` / `!now_live off`"))
+
+    cfg = await _guild_config(ctx.guild.id)
+    session = _session(ctx.guild)
+    _stop_now_playing(session)
+    old = _now_playing_message(session, cfg)
+    session.np_message = None
+    if old is not None:
+        try:
+            await old.delete()
+        except discord.HTTPException:
+            pass
+
+    cfg.now_playing_channel_id = ctx.channel.id if mode == "on" else 0
+    cfg.now_playing_message_id = 0
+    await _save_guild_config(ctx.guild.id)
+    if mode == "off":
+        return await _safe_send(ctx, embed=_music_embed("Teraz gra", "Żywa wiadomość wyłączona."))
+
+    await _safe_send(ctx, embed=_music_embed("Teraz gra", "Żywa wiadomość włączona w tym kanale."), ephemeral=True)
+    # Samą wiadomość wysyła zadanie przez kanał (follow-upu interakcji po 15 min nie da się edytować).
+    await _ensure_now_playing(ctx.guild)
+
+
+# ==========================
+# PAGINATION (przyciski pod listami)
+# ==========================
+PAGINATION_TIMEOUT_SECONDS = float(os.environ.get("PAGINATION_TIMEOUT_SECONDS", "180"))
+PLAYLIST_PAGE_SIZE = 15
+_FILTER_SCAN_CHUNK = 200
+
+
+class _PlaylistPages:
+    """Strony playlisty czytane z magazynu po kawałku (bez wczytywania całej listy)."""
+
+    page_size = PLAYLIST_PAGE_SIZE
+
+    def __init__(self, name: str):
+        self.name = name
+        self.key = _playlist_key(name)
+
+    async def fetch(self, start: int, count: int, flt: str) -> tuple[list[str], bool, Optional[int]]:
+        if not flt:
+            total = await store.llen(self.key)
+            items = await store.lrange(self.key, start, start + count)
+            return [f"{start + i + 1}. {q}" for i, q in enumerate(items)], start + count < total, total
+
+        # Z filtrem przechodzimy listę kawałkami, aż zbierze się strona (+1, żeby wiedzieć czy jest dalej).
+        needle = flt.lower()
+        matched: list[str] = []
+        seen = 0
+        pos = 0
+        while len(matched) <= count:
+            chunk = await store.lrange(self.key, pos, pos + _FILTER_SCAN_CHUNK)
+            if not chunk:
+                break
+            for i, q in enumerate(chunk):
+                if needle in q.lower():
+                    if seen >= start:
+                        matched.append(f"{pos + i + 1}. {q}")
+                    seen += 1
+            pos += len(chunk)
+        return matched[:count], len(matched) > count, None
+
+    def embed(self, lines: list[str]) -> discord.Embed:
+        return _music_embed(f"Playlista: {self.name}", "\n".join(lines) or "(brak wyników)")
+
+
+class _QueuePages:
+    """Strony kolejki serwera; trzyma tylko ID serwera, nie samą sesję."""
+
+    page_size = QUEUE_PREVIEW_SIZE
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+
+    async def fetch(self, start: int, count: int, flt: str) -> tuple[list[str], bool, Optional[int]]:
+        session = _sessions.get(self.guild_id)
+        if session is None:
+            return [], False, 0
+        queue = session.queue
+        if not flt:
+            if start + count <= QUEUE_PREVIEW_SIZE:
+                # Początek kolejki jest już w podglądzie z cache.
+                lines = list(_refresh_preview(session)[2][start:start + count])
+            else:
+                lines = [f"{start + i + 1}. {_render_track(t).line}" for i, t in enumerate(islice(queue, start, start + count))]
+            return lines, start + count < len(queue), len(queue)
+
+        needle = flt.lower()
+        hits = (
+            f"{i + 1}. {_render_track(t).line}"
+            for i, t in enumerate(queue)
+            if needle in str(getattr(t, "title", "")).lower()
+        )
+        lines = list(islice(hits, start, start + count + 1))
+        return lines[:count], len(lines) > count, None
+
+    def embed(self, lines: list[str]) -> discord.Embed:
+        e = _music_embed("Kolejka")
+        session = _sessions.get(self.guild_id)
+        if session and session.current_track:
+            e.add_field(name="Teraz gra", value=_render_track(session.current_track).line, inline=False)
+        e.add_field(name="Następne", value="\n".join(lines) or "(brak)", inline=False)
+        if session:
+            guild = bot.get_guild(self.guild_id)
+            vc = guild.voice_client if guild else None
+            # Jak w niestronicowanej `!queue`; PagedView dopisuje do stopki numer strony.
+            e.set_footer(text=_queue_status(session, vc if isinstance(vc, wavelink.Player) else None))
+        return e
+
+
+class PagedView(discord.ui.View):
+    """Stronicowanie z przyciskami, skokiem do strony i filtrem.
+
+    Po timeoucie przyciski są wyłączane, a widok zwalnia źródło i wiadomość.
+    """
+
+    def __init__(self, source, *, author_id: int):
+        super().__init__(timeout=PAGINATION_TIMEOUT_SECONDS)
+        self.source = source
+        self.author_id = author_id
+        self.page = 0
+        self.filter = ""
+        self.message: Optional[discord.Message] = None
+
+    async def render(self) -> discord.Embed:
+        size = self.source.page_size
+        lines, has_more, total = await self.source.fetch(self.page * size, size, self.filter)
+        if not lines and self.page > 0:
+            self.page = 0
+            lines, has_more, total = await self.source.fetch(0, size, self.filter)
+
+        self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = not has_more
+
+        e = self.source.embed(lines)
+        footer = f"{e.footer.text} • Strona {self.page + 1}" if e.footer.text else f"Strona {self.page + 1}"
+        if total is not None:
+            footer += f"/{max(1, -(-total // size))} • {total} pozycji"
+        if self.filter:
+            footer += f" • filtr: {self.filter}"
+        e.set_footer(text=footer)
+        return e
+
+    async def show(self, interaction: discord.Interaction, page: int):
+        self.page = max(0, page)
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Użyj własnej komendy, żeby przewijać listę.", ephemeral=True)
+            return False
+        return True
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            try:
+                await self.message.edit(view=self)
+            except Exception:
+                pass
+        self.source = None
+        self.message = None
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show(interaction, self.page - 1)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show(interaction, self.page + 1)
+
+    @discord.ui.button(label="Strona…", style=discord.ButtonStyle.primary)
+    async def jump(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_modal(_JumpModal(self))
+
+    @discord.ui.button(label="Filtr…", style=discord.ButtonStyle.primary)
+    async def set_filter(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_modal(_FilterModal(self))
+
+
+class _JumpModal(discord.ui.Modal, title="Skocz do strony"):
+    number = discord.ui.TextInput(label="Numer strony", max_length=6)
+
+    def __init__(self, paged: PagedView):
+        super().__init__()
+        self.paged = paged
+
+    async def on_submit(self, interaction: discord.Interaction):
+        try:
+            page = int(str(self.number.value).strip()) - 1
+        except ValueError:
+            return await interaction.response.send_message("Podaj numer strony.", ephemeral=True)
+        await self.paged.show(interaction, page)
+
+
+class _FilterModal(discord.ui.Modal, title="Filtr"):
+    text = discord.ui.TextInput(label="Fraza (puste = bez filtra)", required=False, max_length=100)
+
+    def __init__(self, paged: PagedView):
+        super().__init__()
+        self.paged = paged
+        self.text.default = paged.filter
+
+    async def on_submit(self, interaction: discord.Interaction):
+        self.paged.filter = str(self.text.value or "").strip()
+        await self.paged.show(interaction, 0)
+
+
+async def _send_paged(ctx: commands.Context, source, total: int):
+    """Jedna strona -> zwykła wiadomość; więcej -> wiadomość z przyciskami."""
+    if total <= source.page_size:
+        lines, _, _ = await source.fetch(0, source.page_size, "")
+        return await _safe_send(ctx, embed=source.embed(lines))
+
+    view = PagedView(source, author_id=ctx.author.id)
+    view.message = await _safe_send(ctx, embed=await view.render(), view=view)
+
 # ==========================
 # SYNC COMMANDS
 # ==========================
@@ -848,10 +2580,15 @@ async def _sync_app_commands():
 
     Jeśli GUILD_ID jest ustawione, synchronizuje tylko dla tego serwera (natychmiastowe).
     W przeciwnym razie robi global sync (może propagować się dłużej).
+    Przy kilku procesach-shardach synchronizuje tylko proces z shardem 0.
     """
+    if SHARD_IDS and 0 not in SHARD_IDS:
+        return
     try:
         if GUILD_ID:
             guild = discord.Object(id=GUILD_ID)
+            # Komendy są zarejestrowane globalnie – bez kopii sync dla serwera wysłałby pustą listę.
+            _tree.copy_global_to(guild=guild)
             synced = await _tree.sync(guild=guild)
             print(f"Zsynchronizowano slash commands dla guild={GUILD_ID}: {len(synced)}")
         else:
@@ -864,12 +2601,97 @@ async def _sync_app_commands():
 @bot.event
 async def setup_hook():
     """Wywoływane raz przy starcie. Najlepsze miejsce na sync slash commands."""
+    _start_lag_watchdog()
     await _sync_app_commands()
 
+# ==========================
+# LOOP LAG WATCHDOG
+# ==========================
+# Ticker w pętli mierzy opóźnienie planowania (histogram `loop_lag_seconds`). Osobny wątek pilnuje,
+# czy ticker żyje – jeśli pętla stoi dłużej niż próg, zrzuca stos głównego wątku razem z nazwą
+# aktywnej komendy/zdarzenia, póki blokada jeszcze trwa.
+LAG_WATCHDOG = os.environ.get("LAG_WATCHDOG", "1") == "1"
+LAG_THRESHOLD_MS = float(os.environ.get("LAG_THRESHOLD_MS", "50"))
+_LAG_TICK_SECONDS = 0.05
+_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_lag_heartbeat: float = 0.0
+_loop_thread_id: Optional[int] = None
+# zadanie -> etykieta (np. "!play"), ustawiana w bot.before_invoke. Słabe klucze: wpis znika razem
+# z zadaniem, nawet gdy after_invoke się nie wykona (hybrydowa komenda slash zakończona błędem).
+_task_labels: weakref.WeakKeyDictionary[asyncio.Task, str] = weakref.WeakKeyDictionary()
+
+
+@bot.before_invoke
+async def _before_command(ctx: commands.Context):
+    task = asyncio.current_task()
+    if task is not None:
+        prefix = "/" if ctx.interaction is not None else "!"
+        _task_labels[task] = f"{prefix}{ctx.command.qualified_name}"
+    # Slash: potwierdzamy od razu (3 s Discorda), chyba że komenda odpowiada natychmiast z pamięci.
+    if not ctx.command.extras.get("instant"):
+        await _defer(ctx)
+
+
+@bot.after_invoke
+async def _after_command(ctx: commands.Context):
+    task = asyncio.current_task()
+    if task is not None:
+        _task_labels.pop(task, None)
+    _note_ack(ctx.interaction)
+
+
+def _active_label(loop: asyncio.AbstractEventLoop) -> str:
+    """Co teraz wykonuje pętla: komenda albo nazwa zadania (discord.py nazywa je "discord.py: on_...")."""
+    current = getattr(asyncio.tasks, "_current_tasks", {}).get(loop)
+    if current is None:
+        return "(callback poza zadaniem)"
+    return _task_labels.get(current) or current.get_name()
+
+
+async def _lag_ticker():
+    global _lag_heartbeat
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + _LAG_TICK_SECONDS
+        _lag_heartbeat = time.monotonic()
+        await asyncio.sleep(_LAG_TICK_SECONDS)
+        lag = max(0.0, loop.time() - expected)
+        _observe("loop_lag_seconds", lag, _LAG_BUCKETS)
+        if lag * 1000 >= LAG_THRESHOLD_MS:
+            _inc("loop_stalls_total")
+
+
+def _lag_monitor(loop: asyncio.AbstractEventLoop):
+    threshold = LAG_THRESHOLD_MS / 1000
+    reported_beat = 0.0
+    while not loop.is_closed():
+        time.sleep(threshold / 2)
+        beat = _lag_heartbeat
+        stalled = time.monotonic() - beat - _LAG_TICK_SECONDS
+        if stalled < threshold or beat == reported_beat or _loop_thread_id is None:
+            continue
+        reported_beat = beat
+
+        frame = sys._current_frames().get(_loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "(brak stosu)"
+        print(f"[watchdog] Pętla zablokowana ≥{stalled * 1000:.0f} ms, aktywne: {_active_label(loop)}\n{stack}")
+
+
+def _start_lag_watchdog():
+    global _loop_thread_id
+    if not LAG_WATCHDOG:
+        return
+    loop = asyncio.get_running_loop()
+    _loop_thread_id = threading.get_ident()
+    loop.create_task(_lag_ticker(), name="lag-watchdog")
+    threading.Thread(target=_lag_monitor, args=(loop,), name="lag-monitor", daemon=True).start()
+
 # ==========================
 # SLASH COMMANDS (podpowiedzi w Discord)
 # ==========================
 
+@loop.autocomplete("mode")
 async def _autocomplete_loop_mode(interaction: discord.Interaction, current: str):
     choices = [
         app_commands.Choice(name="off", value="off"),
@@ -882,11 +2704,171 @@ async def _autocomplete_loop_mode(interaction: discord.Interaction, current: str
 
 async def _autocomplete_playlists(interaction: discord.Interaction, current: str):
     cur = (current or "").lower()
-    names = sorted(playlists.keys())
+    names = await playlist_names()
     filtered = [n for n in names if cur in n.lower()]
     return [app_commands.Choice(name=n, value=n) for n in filtered[:25]]
 
 
+for _command in (playlist_add, playlist_remove, playlist_show, playlist_play, playlist_import, playlist_export):
+    _command.autocomplete("playlist_name")(_autocomplete_playlists)
+
+
+# Podpowiedzi `/play` z Lavalinka w trakcie pisania. Discord czeka na odpowiedź ~3 s, więc:
+# debounce per użytkownik, nowy znak anuluje poprzednie wyszukiwanie tego użytkownika,
+# świeże wyniki idą z LRU, a na serwer przypada najwyżej AUTOCOMPLETE_GUILD_CONCURRENCY wyszukiwań naraz
+# (ponad limit odpowiadamy tym, co jest w cache, zamiast dokładać zapytań do node'a).
+AUTOCOMPLETE_DEBOUNCE_SECONDS = float(os.environ.get("AUTOCOMPLETE_DEBOUNCE_SECONDS", "0.3"))
+AUTOCOMPLETE_DEADLINE_SECONDS = float(os.environ.get("AUTOCOMPLETE_DEADLINE_SECONDS", "2.5"))
+AUTOCOMPLETE_GUILD_CONCURRENCY = int(os.environ.get("AUTOCOMPLETE_GUILD_CONCURRENCY", "2"))
+AUTOCOMPLETE_CACHE_TTL_SECONDS = float(os.environ.get("AUTOCOMPLETE_CACHE_TTL_SECONDS", "300"))
+_AUTOCOMPLETE_CACHE_SIZE = 512
+_AUTOCOMPLETE_MIN_CHARS = 2
+_AUTOCOMPLETE_MAX_CHOICES = 10
+_CHOICE_MAX_LEN = 100
+
+# fraza (lower) -> (czas zapisu, podpowiedzi)
+_suggest_cache: OrderedDict[str, tuple[float, list[app_commands.Choice[str]]]] = OrderedDict()
+# user id -> id ostatniej interakcji autocomplete / trwające wyszukiwanie
+_suggest_latest: dict[int, int] = {}
+_suggest_tasks: dict[int, asyncio.Task] = {}
+_suggest_slots: dict[int, asyncio.Semaphore] = {}
+
+
+def _suggest_cached(q: str) -> Optional[list[app_commands.Choice[str]]]:
+    hit = _suggest_cache.get(q)
+    if hit is None:
+        return None
+    stored_at, choices = hit
+    if time.monotonic() - stored_at > AUTOCOMPLETE_CACHE_TTL_SECONDS:
+        del _suggest_cache[q]
+        return None
+    _suggest_cache.move_to_end(q)
+    return choices
+
+
+def _suggest_fallback(q: str) -> list[app_commands.Choice[str]]:
+    """Najdłuższy zapamiętany prefiks frazy – lepsze to niż pusta lista."""
+    for end in range(len(q) - 1, _AUTOCOMPLETE_MIN_CHARS - 1, -1):
+        choices = _suggest_cached(q[:end])
+        if choices:
+            return choices
+    return []
+
+
+def _suggest_store(q: str, choices: list[app_commands.Choice[str]]):
+    _suggest_cache[q] = (time.monotonic(), choices)
+    _suggest_cache.move_to_end(q)
+    while len(_suggest_cache) > _AUTOCOMPLETE_CACHE_SIZE:
+        _suggest_cache.popitem(last=False)
+
+
+def _track_choice(track: wavelink.Playable) -> Optional[app_commands.Choice[str]]:
+    title = getattr(track, "title", None) or "Unknown title"
+    author = getattr(track, "author", None)
+    name = f"{title} — {author}" if author else title
+    duration = _track_duration_ms(track)
+    if duration:
+        name = f"{name} ({_format_duration_ms(duration)})"
+    if len(name) > _CHOICE_MAX_LEN:
+        name = name[: _CHOICE_MAX_LEN - 1] + "…"
+
+    # Link wskazuje dokładnie ten utwór; gdy jest za długi dla Discorda, zostaje tytuł jako fraza.
+    value = _track_url(track) or ""
+    if not value or len(value) > _CHOICE_MAX_LEN:
+        value = title[:_CHOICE_MAX_LEN]
+    return app_commands.Choice(name=name, value=value)
+
+
+async def _suggest_search(guild_id: int, q: str) -> list[app_commands.Choice[str]]:
+    slots = _suggest_slots.setdefault(guild_id, asyncio.Semaphore(AUTOCOMPLETE_GUILD_CONCURRENCY))
+    # Podpowiedzi liczą się też do limitu wyszukiwań serwera (QUOTA_SEARCHES).
+    async with slots, _search_slot(guild_id):
+        # Jedno zapytanie do najmniej obciążonego node'a – bez hedgingu, żeby pisanie nie dublowało ruchu.
+        nodes = _search_nodes()
+        results = await _timed_search(q, nodes[0] if nodes else None)
+
+    if hasattr(results, "tracks"):
+        results = results.tracks
+    if not isinstance(results, list):
+        results = [results] if results else []
+
+    choices: list[app_commands.Choice[str]] = []
+    for track in results[:_AUTOCOMPLETE_MAX_CHOICES]:
+        choice = _track_choice(track)
+        if choice is not None:
+            choices.append(choice)
+    _suggest_store(q.lower(), choices)
+    return choices
+
+
+@play.autocomplete("query")
+async def _autocomplete_play(interaction: discord.Interaction, current: str):
+    started = time.monotonic()
+    raw = (current or "").strip()
+    q = raw.lower()
+    if len(q) < _AUTOCOMPLETE_MIN_CHARS or len(raw) > _CHOICE_MAX_LEN:
+        return []
+    if raw.startswith(("http://", "https://")):
+        return [app_commands.Choice(name=raw, value=raw)]
+    if interaction.guild is None or not await _has_access(interaction.guild, interaction.channel, interaction.user):
+        return []
+
+    cached = _suggest_cached(q)
+    if cached is not None:
+        _inc("autocomplete_requests_total", result="cache")
+        return cached
+
+    user_id = interaction.user.id
+    _suggest_latest[user_id] = interaction.id
+    previous = _suggest_tasks.pop(user_id, None)
+    if previous is not None:
+        previous.cancel()
+    try:
+        await asyncio.sleep(AUTOCOMPLETE_DEBOUNCE_SECONDS)
+        if _suggest_latest.get(user_id) != interaction.id:
+            # Użytkownik pisze dalej – tę odpowiedź Discord i tak odrzuci.
+            _inc("autocomplete_requests_total", result="debounced")
+            return _suggest_fallback(q)
+
+        slots = _suggest_slots.get(interaction.guild.id)
+        if slots is not None and slots.locked():
+            _inc("autocomplete_requests_total", result="busy")
+            return _suggest_fallback(q)
+
+        task = asyncio.create_task(_suggest_search(interaction.guild.id, raw))
+        # Po timeoucie nikt już nie odbierze wyniku – odbieramy wyjątek, żeby asyncio go nie logowało.
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        _suggest_tasks[user_id] = task
+
+        remaining = AUTOCOMPLETE_DEADLINE_SECONDS - (time.monotonic() - started)
+        done, _ = await asyncio.wait({task}, timeout=max(0.0, remaining))
+        if not done:
+            # Wyszukiwanie leci dalej w tle i zasili cache dla kolejnego znaku – odpinamy je, żeby następna
+            # interakcja go nie anulowała (liczbę takich wyszukiwań i tak ogranicza `_suggest_slots`).
+            if _suggest_tasks.get(user_id) is task:
+                del _suggest_tasks[user_id]
+            _inc("autocomplete_requests_total", result="timeout")
+            return _suggest_fallback(q)
+        if task.cancelled():
+            _inc("autocomplete_requests_total", result="cancelled")
+            return _suggest_fallback(q)
+        if isinstance(task.exception(), QuotaExceeded):
+            _inc("autocomplete_requests_total", result="busy")
+            return _suggest_fallback(q)
+        if task.exception() is not None:
+            print(f"Błąd podpowiedzi /play dla '{raw}': {type(task.exception()).__name__}: {task.exception()}")
+            _inc("autocomplete_requests_total", result="error")
+            return _suggest_fallback(q)
+        _inc("autocomplete_requests_total", result="search")
+        return task.result()
+    finally:
+        if _suggest_latest.get(user_id) == interaction.id:
+            del _suggest_latest[user_id]
+            task = _suggest_tasks.get(user_id)
+            if task is not None and task.done():
+                del _suggest_tasks[user_id]
+
+
 @_tree.command(name="help", description="Pokazuje listę komend i co robią")
 async def slash_help(interaction: discord.Interaction):
     e = _music_embed("Pomoc • Komendy bota")
@@ -894,10 +2876,10 @@ async def slash_help(interaction: discord.Interaction):
     e.add_field(
         name="Konfiguracja",
         value=(
-            "**Prefix:** `!`  •  **Slash:** `/`\n"
-            "• `!set_vc <kanał>` — ustaw kanał głosowy\n"
-            "• `!set_text <kanał>` — ustaw kanał tekstowy (opcjonalnie)\n"
-            "• `!set_role <rola>` — ustaw rolę uprawnioną\n"
+            "**Prefix:** `!`  •  **Slash:** `/` (każda komenda działa w obu wersjach)\n"
+            "• `/set_vc kanał` — ustaw kanał głosowy\n"
+            "• `/set_text kanał` — ustaw kanał tekstowy (opcjonalnie)\n"
+            "• `/set_role rola` — ustaw rolę uprawnioną\n"
         ),
         inline=False,
     )
@@ -919,6 +2901,8 @@ async def slash_help(interaction: discord.Interaction):
         value=(
             "• `/now` lub `!now` — co aktualnie gra\n"
             "• `/queue` lub `!queue_show` — podgląd kolejki\n"
+            "• `/now_live on|off` — jedna, aktualizowana na bieżąco wiadomość „Teraz gra” w tym kanale\n"
+            "• `/history` — ostatnio grane • `/back [nr]` — zagraj ponownie z historii\n"
         ),
         inline=False,
     )
@@ -928,7 +2912,7 @@ async def slash_help(interaction: discord.Interaction):
         value=(
             "• `/loop mode` lub `!loop <mode>`\n"
             "  Dostępne: **off**, **song**, **queue**\n"
-            "• `!loop_status` — aktualny tryb\n"
+            "• `/loop_status` — aktualny tryb\n"
             "\n**Przykład:** `/loop song`"
         ),
         inline=False,
@@ -940,10 +2924,12 @@ async def slash_help(interaction: discord.Interaction):
             "• `/playlist_list` lub `!playlist_list` — lista playlist\n"
             "• `/playlist_show name` lub `!playlist_show <name>`\n"
             "• `/playlist_play name` lub `!playlist_play <name>` — dodaj playlistę do kolejki\n"
-            "\n**Zarządzanie (prefix):**\n"
-            "• `!playlist_create <name>` — utwórz\n"
-            "• `!playlist_add <name> <query>` — dodaj wpis\n"
-            "• `!playlist_remove <name> <query>` — usuń wpis"
+            "\n**Zarządzanie:**\n"
+            "• `/playlist_create name` — utwórz\n"
+            "• `/playlist_add name query` — dodaj wpis\n"
+            "• `/playlist_remove name query` — usuń wpis\n"
+            "• `/playlist_import name plik` — import (.txt/.csv/.json)\n"
+            "• `/playlist_export name [txt|json]` — eksport do pliku"
         ),
         inline=False,
     )
@@ -956,14 +2942,46 @@ async def slash_help(interaction: discord.Interaction):
 # ==========================
 # SAFETY / ERROR HANDLING
 # ==========================
-async def _safe_send(ctx_or_interaction, *, content: Optional[str] = None, embed: Optional[discord.Embed] = None, ephemeral: bool = False):
+async def _defer(ctx: commands.Context):
+    """Potwierdza komendę slash ("myśli…"); dla prefixu nic nie robi. Odpowiedzi idą potem jako follow-up."""
+    interaction = ctx.interaction
+    if interaction is None or interaction.response.is_done():
+        return
+    try:
+        await interaction.response.defer(thinking=True)
+    except discord.HTTPException as e:
+        print(f"Nie udało się potwierdzić interakcji: {e}")
+        return
+    _note_ack(interaction)
+
+
+async def _safe_send(
+    ctx_or_interaction,
+    *,
+    content: Optional[str] = None,
+    embed: Optional[discord.Embed] = None,
+    ephemeral: bool = False,
+    view: Optional[discord.ui.View] = None,
+    file: Optional[discord.File] = None,
+):
     """Bezpieczne wysyłanie wiadomości (nie wywala bota, jeśli np. brak uprawnień)."""
+    # Z widokiem potrzebujemy obiektu wiadomości (żeby widok mógł ją edytować po timeoucie).
+    extra = {"view": view} if view is not None else {}
+    if file is not None:
+        extra["file"] = file
     try:
         if isinstance(ctx_or_interaction, discord.Interaction):
             if ctx_or_interaction.response.is_done():
-                return await ctx_or_interaction.followup.send(content=content, embed=embed, ephemeral=ephemeral)
-            return await ctx_or_interaction.response.send_message(content=content, embed=embed, ephemeral=ephemeral)
-        return await ctx_or_interaction.send(content=content, embed=embed)
+                return await ctx_or_interaction.followup.send(
+                    content=content, embed=embed, ephemeral=ephemeral, wait=view is not None, **extra
+                )
+            sent = await ctx_or_interaction.response.send_message(content=content, embed=embed, ephemeral=ephemeral, **extra)
+            _note_ack(ctx_or_interaction)
+            return await ctx_or_interaction.original_response() if view is not None else sent
+        # Context (także komendy hybrydowe wywołane jako slash); `ephemeral` działa tylko dla slash.
+        sent = await ctx_or_interaction.send(content=content, embed=embed, ephemeral=ephemeral, **extra)
+        _note_ack(ctx_or_interaction.interaction)
+        return sent
     except Exception as e:
         print(f"Nie udało się wysłać wiadomości: {e}")
         return None
@@ -971,10 +2989,21 @@ async def _safe_send(ctx_or_interaction, *, content: Optional[str] = None, embed
 
 @bot.event
 async def on_command_error(ctx: commands.Context, error: Exception):
-    """Globalny handler błędów dla komend prefixowych (!)."""
+    """Globalny handler błędów dla komend prefixowych (!) i hybrydowych."""
+    # Wyjątki z wnętrza komendy przychodzą opakowane (CommandInvokeError / HybridCommandError).
+    while getattr(error, "original", None) is not None:
+        error = error.original
     try:
+        if isinstance(error, QuotaExceeded):
+            _inc("quota_rejections_total", resource=error.resource)
+            return await _safe_send(ctx, embed=_quota_message(error))
+        if isinstance(error, AdmissionRejected):
+            return await _safe_send(ctx, embed=_admission_message(error))
         if isinstance(error, commands.CheckFailure):
-            return  # cicho
+            # Prefix – cicho; slash musi dostać odpowiedź, inaczej Discord pokaże "interakcja nie powiodła się".
+            if ctx.interaction is not None:
+                await _safe_send(ctx, embed=_music_embed("Brak dostępu", "Nie możesz użyć tej komendy tutaj."), ephemeral=True)
+            return
         if isinstance(error, commands.MissingRequiredArgument):
             return await _safe_send(ctx, embed=_music_embed("Błąd", "Brak argumentu komendy."))
         if isinstance(error, commands.BadArgument):
@@ -986,6 +3015,9 @@ async def on_command_error(ctx: commands.Context, error: Exception):
         await _safe_send(ctx, embed=_music_embed("Błąd", "Coś poszło nie tak przy wykonywaniu komendy."))
     except Exception as e:
         print(f"Błąd on_command_error: {e}")
+    finally:
+        # Hybrydowa komenda slash zakończona błędem nie przechodzi przez after_invoke.
+        _note_ack(ctx.interaction)
 
 
 @bot.tree.error
@@ -1001,6 +3033,181 @@ async def on_app_command_error(interaction: discord.Interaction, error: app_comm
         print(f"Błąd on_app_command_error: {e}")
 
 
+# ==========================
+# DIAGNOSTICS
+# ==========================
+# Profilowanie i zrzuty pamięci bez restartu; wyniki lecą jako załącznik. Ciężka praca idzie do wątku,
+# więc bot działa dalej w trakcie pomiaru. Profil, tracemalloc i zadania dotyczą całego procesu
+# (wszystkich serwerów na shardzie), więc mają do nich dostęp tylko właściciele bota.
+PROFILE_MAX_SECONDS = 120
+_SAMPLE_INTERVAL_SECONDS = 0.005
+_profile_running = False
+_mem_baseline: Optional[tracemalloc.Snapshot] = None
+
+
+def admin_only():
+    """Właściciel bota albo administrator serwera (tylko dla widoków ograniczonych do własnego serwera)."""
+
+    async def predicate(ctx: commands.Context):
+        if await bot.is_owner(ctx.author):
+            return True
+        perms = getattr(ctx.author, "guild_permissions", None)
+        return bool(perms and perms.administrator)
+
+    return commands.check(predicate)
+
+
+def _mem_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>"))
+    )
+
+
+def _report_file(text: str, filename: str) -> discord.File:
+    return discord.File(io.BytesIO(text.encode("utf-8")), filename=filename)
+
+
+def _sample_stacks(thread_id: int, seconds: float) -> tuple[Counter, int]:
+    """Próbkuje stos wątku pętli; wynik w formacie "collapsed" (flamegraph.pl / speedscope)."""
+    stacks: Counter = Counter()
+    samples = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stacks[";".join(reversed(parts))] += 1
+            samples += 1
+        time.sleep(_SAMPLE_INTERVAL_SECONDS)
+    return stacks, samples
+
+
+@bot.command(name="debug_profile")
+@commands.is_owner()
+async def debug_profile(ctx, seconds: int = 10, mode: str = "sample"):
+    """Profil CPU przez N sekund: `sample` (próbkowanie, tanie) albo `cprofile`."""
+    global _profile_running
+    if _profile_running:
+        return await _safe_send(ctx, embed=_music_embed("Profil", "Profilowanie już trwa."))
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    mode = mode.strip().lower()
+    if mode not in ("sample", "cprofile"):
+        return await _safe_send(ctx, embed=_music_embed("Profil", "Użyj: `!debug_profile <sekundy> sample|cprofile`"))
+
+    _profile_running = True
+    try:
+        await _safe_send(ctx, embed=_music_embed("Profil", f"Zbieram profil (`{mode}`) przez **{seconds}s**…"))
+        if mode == "sample":
+            stacks, samples = await asyncio.to_thread(_sample_stacks, threading.get_ident(), seconds)
+            body = "\n".join(f"{stack} {n}" for stack, n in stacks.most_common())
+            text = f"# {samples} próbek co {_SAMPLE_INTERVAL_SECONDS * 1000:.0f} ms, format collapsed\n{body}\n"
+            filename = "profile-collapsed.txt"
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+
+            def _format() -> str:
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(80)
+                return out.getvalue()
+
+            text = await asyncio.to_thread(_format)
+            filename = "profile-cprofile.txt"
+    finally:
+        _profile_running = False
+
+    await _safe_send(ctx, embed=_music_embed("Profil", "Gotowe."), file=_report_file(text, filename))
+
+
+@bot.command(name="debug_mem")
+@commands.is_owner()
+async def debug_mem(ctx, action: str = "diff"):
+    """Snapshoty tracemalloc: `diff` (przyrost od poprzedniego snapshotu) albo `stop`."""
+    global _mem_baseline
+    action = action.strip().lower()
+
+    if action == "stop":
+        tracemalloc.stop()
+        _mem_baseline = None
+        return await _safe_send(ctx, embed=_music_embed("Pamięć", "tracemalloc wyłączony."))
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(10)
+        _mem_baseline = await asyncio.to_thread(_mem_snapshot)
+        return await _safe_send(
+            ctx,
+            embed=_music_embed("Pamięć", "Włączono tracemalloc i zapisano punkt odniesienia.\nPonów `!debug_mem`, żeby zobaczyć przyrost."),
+        )
+
+    previous = _mem_baseline
+
+    def _diff() -> tuple[tracemalloc.Snapshot, str]:
+        current = _mem_snapshot()
+        stats = current.compare_to(previous, "lineno") if previous is not None else current.statistics("lineno")
+        size, peak = tracemalloc.get_traced_memory()
+        lines = [f"# traced={size / 1e6:.1f} MB peak={peak / 1e6:.1f} MB; przyrost wg miejsca alokacji"]
+        lines += [str(stat) for stat in stats[:50]]
+        return current, "\n".join(lines) + "\n"
+
+    _mem_baseline, text = await asyncio.to_thread(_diff)
+    await _safe_send(ctx, embed=_music_embed("Pamięć", "Różnica snapshotów w załączniku."), file=_report_file(text, "tracemalloc-diff.txt"))
+
+
+@bot.command(name="debug_tasks")
+@commands.is_owner()
+async def debug_tasks(ctx):
+    """Liczba zadań asyncio pogrupowana po nazwie korutyny."""
+    groups: Counter = Counter()
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        groups[getattr(coro, "__qualname__", None) or type(coro).__name__] += 1
+
+    lines = [f"# {sum(groups.values())} zadań"]
+    lines += [f"{n:6d}  {name}" for name, n in groups.most_common()]
+    await _safe_send(ctx, embed=_music_embed("Zadania", f"Zadań: **{sum(groups.values())}**"), file=_report_file("\n".join(lines) + "\n", "asyncio-tasks.txt"))
+
+
+@bot.command(name="debug_guilds")
+@admin_only()
+async def debug_guilds(ctx, count: int = 10):
+    """Zużycie zasobów: właściciel bota widzi serwery z największym zużyciem, administrator – swój serwer."""
+    if await bot.is_owner(ctx.author):
+        guilds = list(bot.guilds)
+    else:
+        guilds = [ctx.guild] if ctx.guild else []
+    for g in guilds:
+        await _load_storage_usage(g.id)
+
+    usage = [(g, _guild_usage(g.id)) for g in guilds]
+    usage.sort(key=lambda gu: (gu[1].memory_bytes + gu[1].storage_bytes, gu[1].queue_items), reverse=True)
+    count = max(1, min(count, 50))
+
+    def limit(n: int, fmt=str) -> str:
+        return fmt(n) if n else "∞"
+
+    lines = [
+        f"Limity: kolejka {limit(QUOTA_QUEUE_ITEMS)} • pamięć {limit(QUOTA_MEMORY_BYTES, _format_bytes)} • "
+        f"wyszukiwania {limit(QUOTA_SEARCHES)} • playlisty {limit(QUOTA_STORAGE_BYTES, _format_bytes)}",
+        "",
+    ]
+    for g, u in usage[:count]:
+        lines.append(
+            f"**{g.name}** (`{g.id}`): kolejka {u.queue_items} • pamięć {_format_bytes(u.memory_bytes)} • "
+            f"wyszukiwania {u.searches} • playlisty {_format_bytes(u.storage_bytes)}"
+        )
+    if len(usage) > count:
+        lines.append(f"… (+{len(usage) - count} serwerów)")
+    await _safe_send(ctx, embed=_music_embed("Zużycie zasobów", "\n".join(lines)[:4000]))
+
+
 # ==========================
 # HELP COMMAND (prefix)
 # ==========================
@@ -1019,8 +3226,9 @@ async def prefix_help(ctx: commands.Context):
         name="Szybki skrót (prefix)",
         value=(
             "• `!play <query>` — dodaj utwór\n"
-            "• `!now` — co gra\n"
+            "• `!now` — co gra • `!now_live on|off` — żywa wiadomość „Teraz gra”\n"
             "• `!queue_show` — kolejka\n"
+            "• `!history` / `!back [nr]` — historia i ponowne odtworzenie\n"
             "• `!pause` / `!resume` / `!skip` / `!stop`\n"
             "• `!loop off|song|queue`\n"
             "• `!playlist_list` / `!playlist_show <name>` / `!playlist_play <name>`"
@@ -1036,3 +3244,5 @@ async def prefix_help(ctx: commands.Context):
 # ==========================
 # (musi być na samym końcu pliku, po definicjach komend)
 bot.run(TOKEN)
+# Pętla już zamknięta – dopisz zaległe zmiany magazynu stanu.
+store.close_sync()
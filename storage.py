@@ -0,0 +1,571 @@
+"""Współdzielony magazyn stanu bota (playlisty, cache wyszukiwania, konfiguracja serwerów).
+
+Backend wybiera zmienna `STATE_STORE`:
+
+- `file://state.json` (domyślnie) – jeden plik JSON, tylko dla pojedynczego procesu,
+- `sqlite:///state.db` – SQLite (WAL), bezpieczny dla kilku procesów na jednej maszynie,
+- `redis://[:haslo@]host:6379/0` – dowolny serwer mówiący protokołem Redis (RESP).
+
+Wszystkie wartości są serializowane do JSON. Oprócz prostego klucz→wartość są listy
+(playlisty, stronicowane bez wczytywania całości) i zbiory (indeks nazw).
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+from typing import Any, Optional
+from urllib.parse import urlparse, unquote
+
+
+class Store:
+    """Interfejs magazynu. Każdy backend implementuje wszystkie metody."""
+
+    async def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, *, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    async def delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    async def keys(self, prefix: str) -> list[str]:
+        raise NotImplementedError
+
+    async def incrby(self, key: str, delta: int) -> int:
+        """Atomowo dodaje `delta` do liczby pod `key` (brak = 0) i zwraca nową wartość."""
+        raise NotImplementedError
+
+    # --- listy ---
+    async def rpush(self, key: str, *values: Any) -> int:
+        raise NotImplementedError
+
+    async def lrange(self, key: str, start: int, stop: int) -> list[Any]:
+        """Elementy [start, stop) – jak wycinek w Pythonie (bez ujemnych indeksów)."""
+        raise NotImplementedError
+
+    async def llen(self, key: str) -> int:
+        raise NotImplementedError
+
+    async def ldel_index(self, key: str, index: int) -> None:
+        raise NotImplementedError
+
+    # --- zbiory ---
+    async def sadd(self, key: str, *members: str) -> None:
+        raise NotImplementedError
+
+    async def srem(self, key: str, *members: str) -> None:
+        raise NotImplementedError
+
+    async def smembers(self, key: str) -> set[str]:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        return None
+
+    def close_sync(self) -> None:
+        """Zamknięcie poza pętlą asyncio (po `bot.run`)."""
+        return None
+
+
+# ==========================
+# FILE (JSON)
+# ==========================
+class FileStore(Store):
+    """Wszystko w pamięci, zapis do pliku z opóźnieniem (kilka zmian = jeden zapis)."""
+
+    FLUSH_DELAY_SECONDS = 1.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self._kv: dict[str, tuple[Any, Optional[float]]] = {}
+        self._lists: dict[str, list[Any]] = {}
+        self._sets: dict[str, set[str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Nie udało się wczytać {self.path}: {e}")
+            return
+        self._kv = {k: (v[0], v[1]) for k, v in (data.get("kv") or {}).items()}
+        self._lists = {k: list(v) for k, v in (data.get("lists") or {}).items()}
+        self._sets = {k: set(v) for k, v in (data.get("sets") or {}).items()}
+
+    def _purge_expired(self):
+        """Usuwa z pamięci wygasłe wpisy (np. cache wyszukiwań), nie tylko z zapisywanego pliku."""
+        now = time.time()
+        expired = [k for k, (_, exp) in self._kv.items() if exp is not None and exp <= now]
+        for k in expired:
+            del self._kv[k]
+
+    def _snapshot(self) -> dict:
+        """Płytka kopia stanu – tania w pętli; serializacja idzie już w wątku."""
+        self._purge_expired()
+        return {
+            "kv": {k: [v, exp] for k, (v, exp) in self._kv.items()},
+            "lists": {k: list(v) for k, v in self._lists.items()},
+            "sets": {k: list(v) for k, v in self._sets.items()},
+        }
+
+    def _write(self, snapshot: dict):
+        payload = json.dumps(snapshot, ensure_ascii=False)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp, self.path)
+
+    def _changed(self):
+        if self._flush_task and not self._flush_task.done():
+            return
+        self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.FLUSH_DELAY_SECONDS)
+        await self.flush()
+
+    async def flush(self):
+        await asyncio.to_thread(self._write, self._snapshot())
+
+    async def get(self, key):
+        item = self._kv.get(key)
+        if item is None:
+            return None
+        value, exp = item
+        if exp is not None and exp <= time.time():
+            self._kv.pop(key, None)
+            return None
+        return value
+
+    async def set(self, key, value, *, ttl=None):
+        self._kv[key] = (value, time.time() + ttl if ttl else None)
+        self._changed()
+
+    async def delete(self, *keys):
+        for k in keys:
+            self._kv.pop(k, None)
+            self._lists.pop(k, None)
+            self._sets.pop(k, None)
+        self._changed()
+
+    async def keys(self, prefix):
+        self._purge_expired()
+        names = set(self._kv) | set(self._lists) | set(self._sets)
+        return sorted(k for k in names if k.startswith(prefix))
+
+    async def incrby(self, key, delta):
+        value = int(await self.get(key) or 0) + delta
+        exp = self._kv[key][1] if key in self._kv else None
+        self._kv[key] = (value, exp)
+        self._changed()
+        return value
+
+    async def rpush(self, key, *values):
+        items = self._lists.setdefault(key, [])
+        items.extend(values)
+        self._changed()
+        return len(items)
+
+    async def lrange(self, key, start, stop):
+        return list(self._lists.get(key, [])[start:stop])
+
+    async def llen(self, key):
+        return len(self._lists.get(key, []))
+
+    async def ldel_index(self, key, index):
+        items = self._lists.get(key)
+        if items is not None and 0 <= index < len(items):
+            del items[index]
+            self._changed()
+
+    async def sadd(self, key, *members):
+        self._sets.setdefault(key, set()).update(members)
+        self._changed()
+
+    async def srem(self, key, *members):
+        s = self._sets.get(key)
+        if s is not None:
+            s.difference_update(members)
+            self._changed()
+
+    async def smembers(self, key):
+        return set(self._sets.get(key, set()))
+
+    async def close(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+    def close_sync(self):
+        self._write(self._snapshot())
+
+
+# ==========================
+# SQLITE
+# ==========================
+class SqliteStore(Store):
+    """SQLite w trybie WAL; zapytania idą do wątku, żeby nie blokować pętli."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = asyncio.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL);
+            CREATE TABLE IF NOT EXISTS lists (key TEXT NOT NULL, pos INTEGER NOT NULL, value TEXT NOT NULL,
+                                              PRIMARY KEY (key, pos));
+            CREATE TABLE IF NOT EXISTS sets (key TEXT NOT NULL, member TEXT NOT NULL, PRIMARY KEY (key, member));
+            """
+        )
+
+    async def _run(self, fn, *args):
+        async with self._lock:
+            return await asyncio.to_thread(fn, *args)
+
+    def _tx(self, fn):
+        """Wykonuje `fn` w jednej transakcji (BEGIN IMMEDIATE – blokada zapisu między procesami)."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn()
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+        return result
+
+    async def get(self, key):
+        def _q():
+            row = self._db.execute("SELECT value, expires FROM kv WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] <= time.time():
+                self._db.execute("DELETE FROM kv WHERE key = ?", (key,))
+                return None
+            return json.loads(row[0])
+
+        return await self._run(_q)
+
+    async def set(self, key, value, *, ttl=None):
+        payload = json.dumps(value, ensure_ascii=False)
+        expires = time.time() + ttl if ttl else None
+        await self._run(
+            self._db.execute,
+            "INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+            (key, payload, expires),
+        )
+
+    async def incrby(self, key, delta):
+        def _q():
+            # Odczyt i zapis w jednej transakcji – inne procesy nie nadpiszą sobie nawzajem sumy.
+            self._db.execute(
+                "INSERT INTO kv (key, value, expires) VALUES (?, ?, NULL) "
+                "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value",
+                (key, delta),
+            )
+            return int(self._db.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()[0])
+
+        return await self._run(self._tx, _q)
+
+    async def delete(self, *keys):
+        def _q():
+            for k in keys:
+                self._db.execute("DELETE FROM kv WHERE key = ?", (k,))
+                self._db.execute("DELETE FROM lists WHERE key = ?", (k,))
+                self._db.execute("DELETE FROM sets WHERE key = ?", (k,))
+
+        await self._run(self._tx, _q)
+
+    async def keys(self, prefix):
+        def _q():
+            like = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            rows = self._db.execute(
+                "SELECT key FROM kv WHERE key LIKE ? ESCAPE '\\' "
+                "UNION SELECT DISTINCT key FROM lists WHERE key LIKE ? ESCAPE '\\' "
+                "UNION SELECT DISTINCT key FROM sets WHERE key LIKE ? ESCAPE '\\'",
+                (like, like, like),
+            ).fetchall()
+            return sorted(r[0] for r in rows)
+
+        return await self._run(_q)
+
+    async def rpush(self, key, *values):
+        def _q():
+            row = self._db.execute("SELECT COALESCE(MAX(pos), -1) FROM lists WHERE key = ?", (key,)).fetchone()
+            start = row[0] + 1
+            self._db.executemany(
+                "INSERT INTO lists (key, pos, value) VALUES (?, ?, ?)",
+                [(key, start + i, json.dumps(v, ensure_ascii=False)) for i, v in enumerate(values)],
+            )
+            return self._db.execute("SELECT COUNT(*) FROM lists WHERE key = ?", (key,)).fetchone()[0]
+
+        return await self._run(self._tx, _q)
+
+    async def lrange(self, key, start, stop):
+        def _q():
+            rows = self._db.execute(
+                "SELECT value FROM lists WHERE key = ? ORDER BY pos LIMIT ? OFFSET ?",
+                (key, max(0, stop - start), start),
+            ).fetchall()
+            return [json.loads(r[0]) for r in rows]
+
+        return await self._run(_q)
+
+    async def llen(self, key):
+        def _q():
+            return self._db.execute("SELECT COUNT(*) FROM lists WHERE key = ?", (key,)).fetchone()[0]
+
+        return await self._run(_q)
+
+    async def ldel_index(self, key, index):
+        def _q():
+            row = self._db.execute(
+                "SELECT pos FROM lists WHERE key = ? ORDER BY pos LIMIT 1 OFFSET ?", (key, index)
+            ).fetchone()
+            if row is not None:
+                self._db.execute("DELETE FROM lists WHERE key = ? AND pos = ?", (key, row[0]))
+
+        await self._run(self._tx, _q)
+
+    async def sadd(self, key, *members):
+        await self._run(
+            self._db.executemany,
+            "INSERT OR IGNORE INTO sets (key, member) VALUES (?, ?)",
+            [(key, m) for m in members],
+        )
+
+    async def srem(self, key, *members):
+        await self._run(
+            self._db.executemany,
+            "DELETE FROM sets WHERE key = ? AND member = ?",
+            [(key, m) for m in members],
+        )
+
+    async def smembers(self, key):
+        def _q():
+            return {r[0] for r in self._db.execute("SELECT member FROM sets WHERE key = ?", (key,)).fetchall()}
+
+        return await self._run(_q)
+
+    async def close(self):
+        await self._run(self._db.close)
+
+    def close_sync(self):
+        self._db.close()
+
+
+# ==========================
+# REDIS (RESP)
+# ==========================
+class RedisError(Exception):
+    pass
+
+
+class _NotSent(Exception):
+    """Polecenie nie zostało wysłane (błąd przed zapisem albo w trakcie) – można je bezpiecznie ponowić."""
+
+
+class RedisStore(Store):
+    """Minimalny klient RESP2 na asyncio – bez zewnętrznych zależności.
+
+    Działa z Redisem i dowolnym serwerem zgodnym z jego protokołem.
+    """
+
+    _DELETED = "\x00__deleted__"
+
+    def __init__(self, host: str, port: int = 6379, db: int = 0, password: Optional[str] = None, prefix: str = ""):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    def _drop(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _connect(self):
+        self._drop()
+        try:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            if self.password:
+                await self._roundtrip("AUTH", self.password)
+            if self.db:
+                await self._roundtrip("SELECT", str(self.db))
+        except _NotSent as e:
+            self._drop()
+            raise e.__cause__
+        except BaseException:
+            # Nieudane AUTH/SELECT nie może zostawić połączenia bez uwierzytelnienia albo na złej bazie.
+            self._drop()
+            raise
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [f"*{len(args)}\r\n".encode()]
+        for a in args:
+            b = a if isinstance(a, bytes) else str(a).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(b), b))
+        return b"".join(out)
+
+    async def _read_reply(self):
+        assert self._reader is not None
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis zamknął połączenie")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = await self._reader.readexactly(n + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            n = int(rest)
+            if n < 0:
+                return None
+            return [await self._read_reply() for _ in range(n)]
+        raise RedisError(f"Nieznana odpowiedź RESP: {line!r}")
+
+    async def _roundtrip(self, *args):
+        """Wysyła polecenie i czyta odpowiedź. Przy każdym błędzie (także anulowaniu) zamyka połączenie –
+        nieodczytana odpowiedź trafiłaby inaczej do następnego polecenia."""
+        assert self._writer is not None
+        try:
+            self._writer.write(self._encode(args))
+            await self._writer.drain()
+        except (ConnectionError, OSError) as e:
+            self._drop()
+            raise _NotSent() from e
+        except BaseException:
+            self._drop()
+            raise
+        try:
+            return await self._read_reply()
+        except BaseException:
+            self._drop()
+            raise
+
+    async def command(self, *args):
+        async with self._lock:
+            for attempt in (1, 2):
+                # Połączenie zamknięte przez serwer (np. po bezczynności) widać jako EOF jeszcze przed wysłaniem.
+                if self._writer is None or self._writer.is_closing() or self._reader.at_eof():
+                    try:
+                        await self._connect()
+                    except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                        if attempt == 2:
+                            raise
+                        continue
+                try:
+                    return await self._roundtrip(*args)
+                except _NotSent as e:
+                    # Ponawiamy tylko polecenie, które nie doszło do serwera – RPUSH/LREM/INCRBY nie mogą się wykonać dwa razy.
+                    if attempt == 2:
+                        raise e.__cause__
+
+    def _k(self, key: str) -> str:
+        return self.prefix + key
+
+    async def get(self, key):
+        raw = await self.command("GET", self._k(key))
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key, value, *, ttl=None):
+        payload = json.dumps(value, ensure_ascii=False)
+        if ttl:
+            await self.command("SET", self._k(key), payload, "PX", int(ttl * 1000))
+        else:
+            await self.command("SET", self._k(key), payload)
+
+    async def delete(self, *keys):
+        if keys:
+            await self.command("DEL", *(self._k(k) for k in keys))
+
+    async def keys(self, prefix):
+        found: set[str] = set()
+        cursor = "0"
+        while True:
+            cursor, batch = await self.command("SCAN", cursor, "MATCH", self._k(prefix) + "*", "COUNT", 500)
+            found.update(k[len(self.prefix):] for k in batch)
+            if cursor == "0":
+                return sorted(found)
+
+    async def incrby(self, key, delta):
+        return await self.command("INCRBY", self._k(key), int(delta))
+
+    async def rpush(self, key, *values):
+        if not values:
+            return await self.llen(key)
+        return await self.command("RPUSH", self._k(key), *(json.dumps(v, ensure_ascii=False) for v in values))
+
+    async def lrange(self, key, start, stop):
+        if stop <= start:
+            return []
+        raw = await self.command("LRANGE", self._k(key), start, stop - 1)
+        return [json.loads(v) for v in raw or []]
+
+    async def llen(self, key):
+        return await self.command("LLEN", self._k(key))
+
+    async def ldel_index(self, key, index):
+        # Redis nie ma usuwania po indeksie: podmień na znacznik i usuń znacznik.
+        try:
+            await self.command("LSET", self._k(key), index, self._DELETED)
+        except RedisError:
+            return
+        await self.command("LREM", self._k(key), 1, self._DELETED)
+
+    async def sadd(self, key, *members):
+        if members:
+            await self.command("SADD", self._k(key), *members)
+
+    async def srem(self, key, *members):
+        if members:
+            await self.command("SREM", self._k(key), *members)
+
+    async def smembers(self, key):
+        return set(await self.command("SMEMBERS", self._k(key)) or [])
+
+    async def close(self):
+        self._drop()
+
+
+def is_process_local(url: str) -> bool:
+    """Czy backend z `url` żyje w pamięci jednego procesu (file:// albo sama ścieżka) – nie do współdzielenia."""
+    return urlparse(url).scheme in ("", "file")
+
+
+def open_store(url: str) -> Store:
+    """Tworzy backend na podstawie URL-a z `STATE_STORE`."""
+    parsed = urlparse(url)
+    if is_process_local(url):
+        return FileStore((parsed.netloc + parsed.path) if parsed.scheme else url)
+    if parsed.scheme == "sqlite":
+        # sqlite:///state.db -> state.db, sqlite:////var/data/state.db -> /var/data/state.db
+        return SqliteStore(url.split("://", 1)[1].removeprefix("/"))
+    if parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        password = unquote(parsed.password) if parsed.password else None
+        return RedisStore(parsed.hostname or "localhost", parsed.port or 6379, db, password, prefix="dtb:")
+    raise ValueError(f"Nieznany backend STATE_STORE: {url}")
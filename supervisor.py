@@ -0,0 +1,148 @@
+"""Supervisor: uruchamia bota jako kilka procesów-shardów i restartuje je po awarii.
+
+Start: `python supervisor.py` (zamiast `python bot.py`).
+
+- `SHARD_COUNT` – łączna liczba shardów (0/brak = liczba zalecana przez Discord),
+- `SHARD_PROCESSES` – na ile procesów je podzielić (domyślnie min(shardy, liczba CPU)),
+- `STATE_STORE` – przy kilku procesach musi być wspólny: `sqlite:///...` albo `redis://...`
+  (z magazynem plikowym supervisor uruchamia jeden proces, a jawne SHARD_PROCESSES>1 kończy się błędem).
+
+Serwer HTTP (Render) uruchamia tylko pierwszy proces.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+import urllib.request
+from typing import Optional
+
+from storage import is_process_local
+
+# Restart z rosnącym opóźnieniem; proces działający dłużej niż STABLE_SECONDS resetuje licznik.
+RESTART_BACKOFF_SECONDS = float(os.environ.get("RESTART_BACKOFF_SECONDS", "2"))
+RESTART_BACKOFF_MAX_SECONDS = float(os.environ.get("RESTART_BACKOFF_MAX_SECONDS", "60"))
+STABLE_SECONDS = 60.0
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+
+def _recommended_shards(token: str) -> int:
+    """Pyta Discord o zalecaną liczbę shardów (GET /gateway/bot)."""
+    req = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "discord-trigger-bot supervisor"},
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return max(1, int(json.load(resp).get("shards", 1)))
+    except Exception as e:
+        print(f"[supervisor] Nie udało się pobrać zalecanej liczby shardów: {e}; używam 1")
+        return 1
+
+
+def _split_shards(shard_count: int, processes: int) -> list[list[int]]:
+    """Rozdziela shardy po procesach: 5 shardów / 2 procesy -> [[0, 2, 4], [1, 3]]."""
+    processes = max(1, min(processes, shard_count))
+    return [list(range(i, shard_count, processes)) for i in range(processes)]
+
+
+class _Worker:
+    def __init__(self, index: int, shard_ids: list[int], shard_count: int):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.proc: Optional[subprocess.Popen] = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+
+    def env(self) -> dict[str, str]:
+        env = dict(os.environ)
+        env["SHARD_COUNT"] = str(self.shard_count)
+        env["SHARD_IDS"] = ",".join(str(i) for i in self.shard_ids)
+        if self.index != 0:
+            env["RUN_WEB"] = "0"
+        return env
+
+    def start(self):
+        self.proc = subprocess.Popen([sys.executable, BOT_SCRIPT], env=self.env())
+        self.started_at = time.monotonic()
+        print(f"[supervisor] proces {self.index} (shardy {self.shard_ids}) pid={self.proc.pid}")
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+
+
+def main():
+    token = os.environ.get("DISCORD_TOKEN")
+    if not token:
+        raise RuntimeError("Brak zmiennej środowiskowej DISCORD_TOKEN")
+
+    shard_count = int(os.environ.get("SHARD_COUNT", "0")) or _recommended_shards(token)
+    requested = int(os.environ.get("SHARD_PROCESSES", "0"))
+    processes = requested or min(shard_count, os.cpu_count() or 1)
+
+    # Magazyn plikowy ma stan w pamięci procesu – kilka procesów nadpisywałoby sobie nawzajem plik.
+    store_url = os.environ.get("STATE_STORE", "file://state.json")
+    if is_process_local(store_url) and min(processes, shard_count) > 1:
+        if requested:
+            raise RuntimeError(
+                f"SHARD_PROCESSES={requested} wymaga współdzielonego STATE_STORE (sqlite:// lub redis://), "
+                f"a ustawiono {store_url}"
+            )
+        print(f"[supervisor] STATE_STORE={store_url} nie jest współdzielony – wszystkie shardy w jednym procesie")
+        processes = 1
+    groups = _split_shards(shard_count, processes)
+
+    workers = [_Worker(i, ids, shard_count) for i, ids in enumerate(groups)]
+    stopping = False
+
+    def _shutdown(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        print(f"[supervisor] sygnał {signum} – zatrzymuję procesy")
+        for w in workers:
+            w.stop()
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    for w in workers:
+        w.start()
+
+    while not stopping:
+        time.sleep(1)
+        now = time.monotonic()
+        for w in workers:
+            if w.proc is None:
+                if now >= w.restart_at:
+                    w.start()
+                continue
+
+            code = w.proc.poll()
+            if code is None:
+                continue
+
+            ran = now - w.started_at
+            w.failures = 0 if ran >= STABLE_SECONDS else w.failures + 1
+            delay = min(RESTART_BACKOFF_MAX_SECONDS, RESTART_BACKOFF_SECONDS * (2 ** w.failures))
+            print(f"[supervisor] proces {w.index} zakończył się (kod {code}) po {ran:.0f}s; restart za {delay:.0f}s")
+            w.proc = None
+            w.restart_at = now + delay
+
+    for w in workers:
+        if w.proc is None:
+            continue
+        try:
+            w.proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            w.proc.kill()
+
+
+if __name__ == "__main__":
+    main()